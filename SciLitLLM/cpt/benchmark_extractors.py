@@ -0,0 +1,67 @@
+import os
+import argparse
+import time
+from collections import Counter
+from pdf_extractors import EXTRACTORS, available_extractors, get_extractor
+
+def word_agreement(text, reference):
+    """Return the bag-of-words F1 between a text and a reference text."""
+    words, reference_words = Counter(text.split()), Counter(reference.split())
+    overlap = sum((words & reference_words).values())
+    if overlap == 0:
+        return 0.0
+    precision = overlap / sum(words.values())
+    recall = overlap / sum(reference_words.values())
+    return 2 * precision * recall / (precision + recall)
+
+def benchmark(pdf_folder, extractors, reference="pypdf2", repeats=1):
+    """Extract every PDF in a folder with each backend and return per-backend throughput and agreement statistics."""
+    pdf_files = sorted(os.path.join(pdf_folder, file) for file in os.listdir(pdf_folder) if file.lower().endswith('.pdf'))
+    reference_texts = {}
+    if reference in available_extractors():
+        reference_extractor = get_extractor(reference)
+        reference_texts = {pdf_path: "\n".join(reference_extractor.extract_pages(pdf_path)) for pdf_path in pdf_files}
+
+    results = []
+    for name in extractors:
+        extractor = get_extractor(name)
+        pages = chars = failures = 0
+        agreements = []
+        start_time = time.perf_counter()
+        for pdf_path in pdf_files:
+            for _ in range(repeats):
+                try:
+                    page_texts = extractor.extract_pages(pdf_path)
+                except Exception as e:
+                    print(f"{name} failed on {pdf_path}: {e}")
+                    failures += 1
+                    break
+                pages += len(page_texts)
+                chars += sum(len(text) for text in page_texts)
+            else:
+                if pdf_path in reference_texts:
+                    agreements.append(word_agreement("\n".join(page_texts), reference_texts[pdf_path]))
+        elapsed = time.perf_counter() - start_time
+        results.append({
+            'extractor': extractor.version(),
+            'pages/s': pages / elapsed,
+            'chars/s': chars / elapsed,
+            'failures': failures,
+            f'agreement vs {reference}': sum(agreements) / len(agreements) if agreements else float('nan'),
+        })
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the throughput of the installed PDF text-extraction backends.")
+    parser.add_argument('--pdf_folder', type=str, default='resources/raw_pdf', help="Path to the folder containing PDF files.")
+    parser.add_argument('--extractors', type=str, nargs='+', default=None, choices=list(EXTRACTORS), help="Backends to benchmark (default: all installed).")
+    parser.add_argument('--reference', type=str, default='pypdf2', help="Backend whose output the others are compared to.")
+    parser.add_argument('--repeats', type=int, default=1, help="Number of times each PDF is extracted.")
+
+    args = parser.parse_args()
+    results = benchmark(args.pdf_folder, args.extractors or available_extractors(), args.reference, args.repeats)
+
+    columns = list(results[0].keys())
+    print(" | ".join(f"{column:>22}" for column in columns))
+    for result in sorted(results, key=lambda r: r['chars/s'], reverse=True):
+        print(" | ".join(f"{value:>22.2f}" if isinstance(value, float) else f"{value:>22}" for value in result.values()))
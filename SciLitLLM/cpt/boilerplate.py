@@ -0,0 +1,85 @@
+"""Removal of running headers, footers, page numbers and journal banners from the pages of extracted PDFs."""
+import os
+import re
+import json
+from collections import Counter
+
+PAGE_NUMBER_PATTERN = re.compile(
+    r'^\W*(page\s*)?(\d+|(?=[ivxlcdm])m{0,3}(cm|cd|d?c{0,3})(xc|xl|l?x{0,3})(ix|iv|v?i{0,3}))(\s*(of|/)\s*\d+)?\W*$',
+    re.IGNORECASE)
+
+
+def normalize_line(line):
+    """Return a matching key for a line: lowercased, whitespace collapsed and digits masked."""
+    return re.sub(r'\d+', '#', ' '.join(line.lower().split()))
+
+
+def edge_line_indices(lines, edge_lines):
+    """Return the indices of the first and last `edge_lines` non-empty lines of a page."""
+    non_empty = [i for i, line in enumerate(lines) if line.strip()]
+    return set(non_empty[:edge_lines] + non_empty[-edge_lines:])
+
+
+def document_edge_keys(pages, edge_lines=3):
+    """Return the set of normalized lines found at the edges of the pages of a document."""
+    keys = set()
+    for page in pages:
+        lines = page.split("\n")
+        keys.update(normalize_line(lines[i]) for i in edge_line_indices(lines, edge_lines))
+    return keys
+
+
+class CorpusLineStats:
+    """Number of documents in which each normalized line appears at a page edge, capped at `max_entries` lines."""
+
+    def __init__(self, min_documents=50, max_entries=1000000):
+        self.min_documents = min_documents
+        self.max_entries = max_entries
+        self.document_counts = Counter()
+
+    def update(self, pages, edge_lines=3):
+        self.document_counts.update(document_edge_keys(pages, edge_lines))
+        if len(self.document_counts) > self.max_entries:
+            self.document_counts = Counter({key: count for key, count in self.document_counts.items() if count > 1})
+
+    def is_frequent(self, key):
+        return self.document_counts[key] >= self.min_documents
+
+    @classmethod
+    def load(cls, stats_path, min_documents=50, max_entries=1000000):
+        stats = cls(min_documents, max_entries)
+        if stats_path and os.path.exists(stats_path):
+            with open(stats_path, 'r', encoding='utf-8') as f:
+                stats.document_counts = Counter(json.load(f))
+        return stats
+
+    def save(self, stats_path):
+        tmp_path = stats_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(dict(self.document_counts), f)
+        os.replace(tmp_path, stats_path)
+
+
+def strip_boilerplate(pages, corpus_stats=None, edge_lines=3, min_page_fraction=0.5):
+    """Remove page numbers, lines repeated at the edges of `min_page_fraction` of the pages and lines frequent in
+    `corpus_stats` from the page edges of one document."""
+    split_pages = [page.split("\n") for page in pages]
+    edges = [edge_line_indices(lines, edge_lines) for lines in split_pages]
+
+    page_counts = Counter()
+    for lines, indices in zip(split_pages, edges):
+        page_counts.update({normalize_line(lines[i]) for i in indices})
+    min_pages = max(2, min_page_fraction * len(pages))
+
+    cleaned_pages = []
+    for lines, indices in zip(split_pages, edges):
+        kept = []
+        for i, line in enumerate(lines):
+            if i in indices:
+                key = normalize_line(line)
+                if PAGE_NUMBER_PATTERN.match(line.strip()) or page_counts[key] >= min_pages \
+                        or (corpus_stats is not None and corpus_stats.is_frequent(key)):
+                    continue
+            kept.append(line)
+        cleaned_pages.append("\n".join(kept))
+    return cleaned_pages
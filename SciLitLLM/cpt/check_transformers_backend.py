@@ -0,0 +1,89 @@
+"""Check the transformers generation backend on CPU with a tiny randomly initialized Llama built locally."""
+import argparse
+import tempfile
+import concurrent.futures
+
+from generation_backends import PromptTooLongError, create_backend
+
+WORDS = "the a of and to in is that for on with as by this are from at be an or which it we results method data".split()
+
+
+def build_tiny_llama(path, max_position_embeddings=64):
+    """Save a tiny random Llama and a whitespace word-level tokenizer to `path`, without downloading anything."""
+    import torch
+    from tokenizers import Tokenizer, models, pre_tokenizers, decoders
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+    vocab = {token: i for i, token in enumerate(["<pad>", "<unk>", "<s>", "</s>"] + WORDS)}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.WhitespaceSplit()
+    tokenizer.decoder = decoders.WordPiece(prefix="##")
+    PreTrainedTokenizerFast(tokenizer_object=tokenizer, bos_token="<s>", eos_token="</s>", unk_token="<unk>",
+                            pad_token="<pad>").save_pretrained(path)
+    torch.manual_seed(0)
+    config = LlamaConfig(vocab_size=len(vocab), hidden_size=32, intermediate_size=64, num_hidden_layers=2,
+                         num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=max_position_embeddings,
+                         pad_token_id=0, bos_token_id=2, eos_token_id=3)
+    model = LlamaForCausalLM(config)
+    with torch.no_grad():
+        # The logit of a special token is then the mean of the word logits, so greedy decoding never ends by itself
+        model.lm_head.weight[:4] = model.lm_head.weight[4:].mean(dim=0)
+    model.save_pretrained(path)
+
+
+def user_message(num_words, offset=0):
+    return [{"role": "user", "content": " ".join(WORDS[(offset + i) % len(WORDS)] for i in range(num_words))}]
+
+
+def check(model, max_batch_size):
+    backend = create_backend('transformers', model, max_batch_size=max_batch_size, max_wait=0.2, device='cpu')
+    try:
+        # Batching: concurrent calls of different lengths give the same texts as one by one
+        prompts = [user_message(3 + i, offset=i) for i in range(2 * max_batch_size)]
+        alone = [backend.generate(messages, max_tokens=8) for messages in prompts]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(prompts)) as executor:
+            batched = list(executor.map(lambda messages: backend.generate(messages, max_tokens=8), prompts))
+        assert batched == alone, (batched, alone)
+        print(f"batching: {len(prompts)} concurrent calls match the sequential results")
+
+        # Finish reasons: 'length' at the token cap, 'stop' at the first end-of-sequence token (the first word here)
+        result = backend.generate(prompts[0], max_tokens=4)
+        assert result.finish_reason == 'length' and len(result.text.split()) == 4, result
+        first_word = backend.generate(prompts[0], max_tokens=1).text
+        backend.eos_token_ids.add(backend.tokenizer.convert_tokens_to_ids(first_word))
+        result = backend.generate(prompts[0], max_tokens=4)
+        backend.eos_token_ids.discard(backend.tokenizer.convert_tokens_to_ids(first_word))
+        assert result.finish_reason == 'stop' and result.text == '', result
+        print("finish reasons: 'length' and 'stop'")
+
+        # Top log-probabilities of the first token
+        result = backend.generate(prompts[0], max_tokens=1, top_logprobs=5)
+        assert len(result.top_logprobs) == 5 and max(result.top_logprobs, key=result.top_logprobs.get) == first_word, result
+        print(f"top_logprobs: {result.top_logprobs}")
+
+        # Prompts longer than the context fail alone, without failing the rest of their batch
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            too_long = executor.submit(backend.generate, user_message(backend.max_context), 8)
+            short = executor.submit(backend.generate, prompts[0], 8)
+            assert short.result() == alone[0]
+            try:
+                too_long.result()
+            except PromptTooLongError as e:
+                print(f"PromptTooLongError: {e}")
+            else:
+                raise AssertionError("A prompt longer than the context did not raise PromptTooLongError.")
+    finally:
+        backend.close()
+    print("All checks passed.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the transformers generation backend on CPU.")
+    parser.add_argument('--max_batch_size', default=4, type=int)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as path:
+        build_tiny_llama(path)
+        check(path, args.max_batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""SQLite cache of LLM corrections, keyed by the model, the prompt template version and the normalized chunk."""
+import os
+import hashlib
+import sqlite3
+import threading
+
+
+def template_version(template):
+    """Return a short hash identifying a prompt template."""
+    return hashlib.sha256(template.encode('utf-8')).hexdigest()[:16]
+
+
+def normalized_hash(text):
+    """Return the hex sha256 of a text with its whitespace collapsed."""
+    return hashlib.sha256(' '.join(text.split()).encode('utf-8')).hexdigest()
+
+
+class CorrectionCache:
+    """Thread-safe cache of corrected chunks in a single SQLite file, shared by all worker threads."""
+
+    def __init__(self, cache_path):
+        cache_path = os.path.expanduser(cache_path)
+        if os.path.dirname(cache_path):
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        self.connection = sqlite3.connect(cache_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS corrections ("
+            "model TEXT, template_version TEXT, text_hash TEXT, corrected TEXT, "
+            "PRIMARY KEY (model, template_version, text_hash))")
+        self.connection.commit()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model, template_version, text):
+        """Return the cached correction of a text, or None on a miss."""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT corrected FROM corrections WHERE model = ? AND template_version = ? AND text_hash = ?",
+                (model, template_version, normalized_hash(text))).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return row[0]
+
+    def put(self, model, template_version, text, corrected):
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO corrections VALUES (?, ?, ?, ?)",
+                (model, template_version, normalized_hash(text), corrected))
+            self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
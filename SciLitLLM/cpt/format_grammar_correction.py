@@ -1,15 +1,25 @@
 import os
 import argparse
 import json
+import hashlib
+import heapq
+import itertools
+import collections
 import concurrent.futures
-from openai import OpenAI, AzureOpenAI
 from tqdm import tqdm
+from jsonl_shards import iter_jsonl_lines, open_jsonl_writer, truncate_jsonl_output
+from text_filter import FEATURE_NAMES, compute_features, filter_texts, load_dictionary
+from correction_cache import CorrectionCache, template_version
+from rule_based_correction import artifact_score, rule_based_fix
+from llm_client import AdaptiveLimiter, parse_endpoints
+from generation_backends import create_backend
+from text_chunker import approximate_token_count, chunk_spans, join_chunks, load_token_counter, separators
 
-# Configure OpenAI client
-client = OpenAI(
-    api_key="YOUR_API_KEY",
-    base_url="http://localhost:8000/v1"
-)
+# Generation backend: OpenAI-compatible LLM endpoints (--llm_endpoint) or an in-process model, set from --backend
+backend = None
+
+# Adaptive limit on the requests in flight, set with --adaptive_concurrency (a fixed limit of --max_workers otherwise)
+concurrency_limiter = None
 
 template = """I have extracted the following raw text from a PDF, but the extraction process has introduced many formatting issues such as unnecessary line breaks, extra spaces, and other artifacts that disrupt the text flow. Could you please help me correct these formatting issues and provide a clean, readable version of the text? Respond with the Corrected Version only.
 
@@ -20,46 +30,197 @@ Raw Text:
 Start your response with "Here is the corrected version of the text:".
 """
 
+edit_template = """I have extracted the following raw text from a PDF, but the extraction process has introduced many formatting issues such as unnecessary line breaks, extra spaces, and other artifacts that disrupt the text flow. Instead of rewriting the text, list the edits that correct these formatting issues, as a JSON array of objects {"find": "<text copied exactly from the raw text>", "replace": "<corrected text>"}, in the order in which they appear in the text. Include a few surrounding words in "find" so that it only matches where the edit applies. Respond with the JSON array only, or [] if the text needs no correction.
+
+Raw Text:
+
+{RawText}
+"""
+
+# Token counter used to size chunks, set from --tokenizer
+count_tokens = approximate_token_count
+
+# 'rewrite' asks the LLM for the corrected text, 'edits' for a list of edits applied locally (set from --correction_mode)
+correction_mode = 'rewrite'
+edit_fallbacks = collections.Counter()
+
+# Output token cap of a correction request: ratio * input tokens + slack, set from --output_token_ratio and --output_token_slack
+output_token_ratio = 1.3
+output_token_slack = 64
+
+# Cache of corrected chunks, set from --correction_cache_path
+correction_cache = None
+
 def chunk_text(text, chunk_size):
-    """Splits the text into chunks based on the chunk size (number of words)."""
-    words = text.split()
-    # Create chunks of text with chunk_size words, joining words back into a single string
-    chunks = [" ".join(words[i:i + chunk_size]) for i in range(0, len(words), chunk_size)]
-    return chunks
+    """Splits the text into chunks of at most `chunk_size` tokens, ending on paragraph, line or sentence boundaries.
+    Returns the chunks and the original whitespace preceding each of them."""
+    # With a correction cache, chunk ends are content-defined so that the chunks after an edit are still cache hits
+    spans = chunk_spans(text, chunk_size, count_tokens, resync=correction_cache is not None)
+    return [text[start:end] for start, end in spans], separators(text, spans)
+
+class TruncatedOutputError(Exception):
+    """Raised when a correction hits its output token cap."""
+
+def output_token_cap(chunk):
+    """Returns the `max_tokens` of the request correcting a chunk: proportional to its token count, plus some slack."""
+    return int(output_token_ratio * count_tokens(chunk)) + output_token_slack
+
+def parse_edits(response):
+    """Returns the (find, replace) pairs of a JSON edit list in the response, or None if it is not a valid edit list."""
+    try:
+        edits = json.loads(response[response.index('['):response.rindex(']') + 1])
+    except ValueError:
+        return None
+    if not isinstance(edits, list) or not all(
+            isinstance(edit, dict) and isinstance(edit.get('find'), str) and edit['find'] and isinstance(edit.get('replace'), str)
+            for edit in edits):
+        return None
+    return [(edit['find'], edit['replace']) for edit in edits]
+
+def apply_edits(chunk, edits):
+    """Applies edits in order, each to the first match of its `find` text after the previous edit.
+    Returns None if an edit does not match, so that no partially edited text is used."""
+    corrected, position = [], 0
+    for find, replace in edits:
+        start = chunk.find(find, position)
+        if start < 0:
+            return None
+        corrected.extend([chunk[position:start], replace])
+        position = start + len(find)
+    corrected.append(chunk[position:])
+    return "".join(corrected)
+
+def request_edits(chunk):
+    """Asks the LLM for an edit list and returns the chunk with the edits applied, or None if no valid edits came back."""
+    messages = [{"role": "user", "content": edit_template.replace("{RawText}", chunk)}]
+    result = backend.generate(messages, max_tokens=output_token_cap(chunk))
+    edits = parse_edits(result.text) if result.finish_reason != 'length' else None
+    return apply_edits(chunk, edits) if edits is not None else None
 
 def process_chunk(chunk, model):
-    """Processes a single chunk of text using LLM."""
+    """Processes a single chunk of text using LLM, or returns its cached correction. Raises TruncatedOutputError if the
+    output hit its token cap."""
+    if correction_cache is not None:
+        for cached_template in ([edit_template, template] if correction_mode == 'edits' else [template]):
+            corrected_chunk = correction_cache.get(model, template_version(cached_template), chunk)
+            if corrected_chunk is not None:
+                return corrected_chunk
+    if correction_mode == 'edits':
+        corrected_chunk = request_edits(chunk)
+        if corrected_chunk is not None:
+            if correction_cache is not None:
+                correction_cache.put(model, template_version(edit_template), chunk, corrected_chunk)
+            return corrected_chunk
+        edit_fallbacks['rewrite'] += 1
     messages = [{"role": "user", "content": template.replace("{RawText}", chunk)}]
+    max_tokens = output_token_cap(chunk)
+    result = backend.generate(messages, max_tokens=max_tokens)
+    if result.finish_reason == 'length':
+        raise TruncatedOutputError(f"correction truncated at {max_tokens} tokens")
+    corrected_chunk = result.text.strip().replace(
+        "Here is the corrected version of the text:", ""
+    ).strip()
+    if correction_cache is not None:
+        correction_cache.put(model, template_version(template), chunk, corrected_chunk)
+    return corrected_chunk
+
+def drop_garbage_chunks(chunks, chunk_separators, dictionary):
+    """Removes the chunks that fail the garbage-text pre-filter, along with their separators."""
+    keep, _ = filter_texts(compute_features(chunks, dictionary))
+    kept = [(chunk, separator) for chunk, separator, kept in zip(chunks, chunk_separators, keep) if kept]
+    return [chunk for chunk, _ in kept], [separator for _, separator in kept]
+
+def chunk_result(future, chunk):
+    """Returns the corrected chunk of a finished request, or the original chunk if the request failed."""
     try:
-        completion = client.chat.completions.create(
-            model=model,
-            messages=messages,
-        )
-        corrected_chunk = completion.choices[0].message.content.strip().replace(
-            "Here is the corrected version of the text:", ""
-        ).strip()
-        return corrected_chunk
+        return future.result()
     except Exception as e:
-        print(f"Error processing text chunk: {e}")
+        print(f"Error processing chunk: {e}")
         return chunk
 
-def process_text_entry(text, model, chunk_size, max_workers):
-    """Processes a single text entry by splitting it into character-based chunks and using LLM to correct it."""
-    corrected_text = []
-    chunks = chunk_text(text, chunk_size)
+def correct_entries(entries, model, chunk_size, max_workers, chunk_dictionary=None, max_pending_entries=None, artifact_threshold=None):
+    """Yields (entry, corrected_text, truncated_chunks, failed_chunks) in input order, with the chunks of all entries
+    sharing `max_workers` in-flight requests, longest first."""
+    rule_based_chunks = total_chunks = 0
+    max_pending_entries = max_pending_entries or 4 * max_workers
+    lookahead = 2 * max_workers
+    in_flight = concurrency_limiter or AdaptiveLimiter(max_workers, min_limit=max_workers, max_limit=max_workers)
+    pending = collections.deque()  # (entry, chunks, separators, futures) in input order
+    waiting = []  # heap of (-length, sequence number, submissions when queued, chunk, future) not submitted yet
+    sequence = itertools.count()
+    submissions = 0
 
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_chunk = {executor.submit(process_chunk, chunk, model): chunk for chunk in chunks}
+    def finished_entries(block=False):
+        while pending and (block or all(future.done() for future in pending[0][3])):
+            entry, chunks, chunk_separators, futures = pending.popleft()
+            corrected_text = join_chunks([chunk_result(future, chunk) for future, chunk in zip(futures, chunks)], chunk_separators)
+            errors = [future.exception() for future in futures]
+            truncated_chunks = sum(isinstance(error, TruncatedOutputError) for error in errors)
+            yield entry, corrected_text, truncated_chunks, sum(error is not None for error in errors) - truncated_chunks
+            block = False
 
-        for future in concurrent.futures.as_completed(future_to_chunk):
-            try:
-                corrected_chunk = future.result()
-                corrected_text.append(corrected_chunk)
-            except Exception as e:
-                print(f"Error processing chunk: {e}")
-                corrected_text.append(future_to_chunk[future])
+    def forward(request, future):
+        in_flight.release()
+        if request.exception() is not None:
+            future.set_exception(request.exception())
+        else:
+            future.set_result(request.result())
 
-    return " ".join(corrected_text)
+    def submit_longest():
+        nonlocal submissions
+        oldest = min(waiting, key=lambda item: item[1])
+        if submissions - oldest[2] >= lookahead:
+            # Passed over by a whole lookahead of longer chunks: send it, so that its entry can be written
+            waiting.remove(oldest)
+            heapq.heapify(waiting)
+            _, _, _, chunk, future = oldest
+        else:
+            _, _, _, chunk, future = heapq.heappop(waiting)
+        submissions += 1
+        in_flight.acquire()
+        request = executor.submit(process_chunk, chunk, model)
+        request.add_done_callback(lambda request: forward(request, future))
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for entry in entries:
+            if 'text' not in entry:
+                print("Error processing entry: missing 'text' field")
+                continue
+            chunks, chunk_separators = chunk_text(entry['text'], chunk_size)
+            if chunk_dictionary is not None:
+                chunks, chunk_separators = drop_garbage_chunks(chunks, chunk_separators, chunk_dictionary)
+            if artifact_threshold is not None:
+                chunks = [rule_based_fix(chunk) for chunk in chunks]
+            futures = []
+            total_chunks += len(chunks)
+            for chunk in chunks:
+                future = concurrent.futures.Future()
+                futures.append(future)
+                if artifact_threshold is not None and artifact_score(chunk) <= artifact_threshold:
+                    future.set_result(chunk)
+                    rule_based_chunks += 1
+                else:
+                    heapq.heappush(waiting, (-len(chunk), next(sequence), submissions, chunk, future))
+            pending.append((entry, chunks, chunk_separators, futures))
+            while len(waiting) > lookahead:
+                yield from finished_entries()
+                submit_longest()
+            if len(pending) >= max_pending_entries:
+                # The oldest entry may still have chunks waiting behind longer ones
+                while waiting:
+                    yield from finished_entries()
+                    submit_longest()
+                yield from finished_entries(block=True)
+            yield from finished_entries()
+        while waiting:
+            yield from finished_entries()
+            submit_longest()
+        while pending:
+            yield from finished_entries(block=True)
+    if artifact_threshold is not None:
+        print(f"{rule_based_chunks} of {total_chunks} chunks were clean enough after rule-based fixes to skip the LLM.")
+    if concurrency_limiter is not None:
+        print(f"Concurrency limit settled at {int(concurrency_limiter.limit)} requests in flight.")
 
 def split_text_to_entries(text, split_size):
     """Splits the text into smaller chunks based on paragraph boundaries and word count limit."""
@@ -96,46 +257,164 @@ def split_text_to_entries(text, split_size):
     return entries
 
 
-def process_jsonl(input_path, output_path, model, chunk_size, split_size, max_workers):
-    """Reads from input JSONL, processes text fields, and writes to output JSONL."""
-    processed_count = 0
+def read_entries(lines):
+    """Yields the parsed JSON entries of the input lines, skipping malformed ones."""
+    for line in lines:
+        try:
+            yield json.loads(line)
+        except Exception as e:
+            print(f"Error processing entry: {e}")
+
+def prefilter_entries(entries, dictionary, quarantine_file=None, batch_size=256):
+    """Yields the entries whose text passes the garbage-text pre-filter (see `text_filter.py`), in batches of `batch_size`.
+    Rejected entries are written to `quarantine_file` with their features and the reasons for rejection."""
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) == batch_size:
+            yield from _prefilter_batch(batch, dictionary, quarantine_file)
+            batch = []
+    yield from _prefilter_batch(batch, dictionary, quarantine_file)
+
+def _prefilter_batch(batch, dictionary, quarantine_file):
+    features = compute_features([entry['text'] for entry in batch], dictionary)
+    keep, reasons = filter_texts(features)
+    for entry, kept, entry_features, entry_reasons in zip(batch, keep, features, reasons):
+        if kept:
+            yield entry
+        elif quarantine_file is not None:
+            quarantine_file.write(json.dumps({**entry, 'prefilter': {'reasons': entry_reasons, 'features': dict(zip(FEATURE_NAMES, entry_features.tolist()))}}) + "\n")
+
+def entry_id(entry):
+    """Returns the identity of an input entry in the progress journal: a hash of its text, after its source file if it has one."""
+    # The text is part of the id, since incremental parsing appends the new version of a changed PDF under the same source
+    source = entry.get('meta_data', {}).get('source')
+    text_hash = hashlib.sha1(entry.get('text', '').encode('utf-8')).hexdigest()
+    return f"{source}:{text_hash}" if source else text_hash
+
+def load_journal(journal_path):
+    """Returns the ids of the entries recorded in a progress journal and the output position after the last of them."""
+    done, position = set(), 0
+    if os.path.exists(journal_path):
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break  # line cut short by a crash
+                done.add(record['id'])
+                position = record['position']
+    return done, position
+
+def process_jsonl(input_path, output_path, model, chunk_size, split_size, max_workers, shard_size_mb=0,
+                  prefilter=None, dictionary_path=None, quarantine_path=None, journal_path=None, resume=False,
+                  artifact_threshold=None):
+    """Reads from input JSONL (a file or a shard index), processes text fields, and writes to output JSONL, journaling
+    progress so that an interrupted run can `resume`."""
+    processed_count = total_truncated_chunks = total_failed_chunks = 0
+    dictionary = load_dictionary(dictionary_path) if prefilter else None
+    journal_path = journal_path or output_path + '.progress.jsonl'
+    done, position = load_journal(journal_path) if resume else (set(), 0)
+    if resume:
+        truncate_jsonl_output(output_path, shard_size_mb, position)
+        print(f"Resuming after {len(done)} entries.")
+    mode = 'a' if resume else 'w'
     
-    with open(input_path, 'r', encoding='utf-8') as infile, open(output_path, 'w', encoding='utf-8') as outfile:
-        lines = infile.readlines()
+    with open_jsonl_writer(output_path, shard_size_mb, mode) as outfile, open(journal_path, mode, encoding='utf-8') as journal_file, \
+            open(quarantine_path or os.devnull, 'w', encoding='utf-8') as quarantine_file:
+        entries = (entry for entry in read_entries(iter_jsonl_lines(input_path)) if entry_id(entry) not in done)
+        if prefilter == 'document':
+            entries = prefilter_entries(entries, dictionary, quarantine_file)
         
-        for line in tqdm(lines, desc="Processing JSONL"):
+        corrected_entries = correct_entries(entries, model, chunk_size, max_workers, dictionary if prefilter == 'chunk' else None,
+                                            artifact_threshold=artifact_threshold)
+        for entry, corrected_text, truncated_chunks, failed_chunks in tqdm(corrected_entries, desc="Processing JSONL"):
             try:
-                entry = json.loads(line)
-                text = entry['text']
-                corrected_text = process_text_entry(text, model, chunk_size, max_workers)
-                
-                split_entries = split_text_to_entries(corrected_text, split_size)
+                if prefilter == 'chunk' and not corrected_text.strip():
+                    # Every chunk was dropped by the pre-filter: quarantined like a rejected document instead of written empty
+                    quarantine_file.write(json.dumps({**entry, 'prefilter': {'reasons': ['all_chunks_filtered']}}) + "\n")
+                    split_entries = []
+                else:
+                    split_entries = split_text_to_entries(corrected_text, split_size)
+                total_truncated_chunks += truncated_chunks
+                total_failed_chunks += failed_chunks
+                source = entry.get('meta_data', {}).get('source')
                 for split_entry in split_entries:
+                    if source is not None:
+                        split_entry['meta_data']['source'] = source
+                    if truncated_chunks:
+                        split_entry['meta_data']['truncated_chunks'] = truncated_chunks
+                    if failed_chunks:
+                        split_entry['meta_data']['failed_chunks'] = failed_chunks
                     json.dump(split_entry, outfile)
                     outfile.write('\n')
+                outfile.flush()
+                # Journaled after the output is flushed, so a crash in between redoes the entry instead of losing it.
+                journal_file.write(json.dumps({'id': entry_id(entry), 'position': outfile.tell()}) + "\n")
+                journal_file.flush()
                 
                 processed_count += 1
             except Exception as e:
                 print(f"Error processing entry: {e}")
     
     print(f"Total processed entries: {processed_count}")
+    if edit_fallbacks:
+        print(f"{edit_fallbacks['rewrite']} chunks fell back to a full rewrite because their edit list was invalid or did not apply.")
+    if total_truncated_chunks:
+        print(f"{total_truncated_chunks} chunks hit their output token cap and were kept uncorrected (flagged with 'truncated_chunks').")
+    if total_failed_chunks:
+        print(f"{total_failed_chunks} chunks failed after all retries and were kept uncorrected (flagged with 'failed_chunks').")
+    if correction_cache is not None:
+        print(f"Correction cache: {correction_cache.hits} hits, {correction_cache.misses} misses.")
 
 def main():
     parser = argparse.ArgumentParser(description="Correct formatting and grammar of text fields in a JSONL file using an LLM.")
-    parser.add_argument('--input_path', type=str, default='resources/parse-text.jsonl', help="Path to the input JSONL file.")
+    parser.add_argument('--input_path', type=str, default='resources/parse-text.jsonl', help="Path to the input JSONL file, gzipped JSONL file or shard index.")
     parser.add_argument('--output_path', type=str, default='resources/parse-correction-text.jsonl', help="Path to the output JSONL file.")
-    parser.add_argument('--chunk_size', type=int, default=1024, help="Maximum size of text chunks to process with LLM.")
+    parser.add_argument('--chunk_size', type=int, default=1024, help="Maximum size in tokens of text chunks to process with LLM.")
+    parser.add_argument('--correction_cache_path', type=str, default=None, help="SQLite file caching corrected chunks across runs, keyed by model, prompt template and normalized chunk text.")
+    parser.add_argument('--correction_mode', type=str, default='rewrite', choices=['rewrite', 'edits'], help="Ask the LLM for the corrected text, or for a list of edits applied locally (falling back to a rewrite when they do not apply).")
+    parser.add_argument('--output_token_ratio', type=float, default=1.3, help="Output token cap of each request, as a multiple of its input tokens.")
+    parser.add_argument('--output_token_slack', type=int, default=64, help="Tokens added to the output token cap of each request.")
+    parser.add_argument('--tokenizer', type=str, default=None, help="Hugging Face tokenizer of the served model, used to measure chunks; defaults to an approximate token count.")
     parser.add_argument('--split_size', type=int, default=2048, help="Maximum characters of splited texts.")
-    parser.add_argument('--max_workers', type=int, default=2, help="Maximum number of concurrent workers.")
-    parser.add_argument('--llm_endpoint', type=str, default='localhost:8000', help="Base URL for the LLM API.")
+    parser.add_argument('--max_workers', type=int, default=2, help="Maximum number of chunk requests in flight at once, across all documents.")
+    parser.add_argument('--adaptive_concurrency', action='store_true', help="Adjust the number of requests in flight (up to --max_workers) from the observed latency and errors of the LLM servers.")
+    parser.add_argument('--backend', type=str, default='openai', choices=['openai', 'transformers'], help="Send requests to the LLM servers of --llm_endpoint, or generate in-process with the Hugging Face model --model.")
+    parser.add_argument('--batch_size', type=int, default=8, help="Batch size of the transformers backend; keep --max_workers at least as large.")
+    parser.add_argument('--torch_dtype', type=str, default=None, help="Weights dtype of the transformers backend, e.g. bfloat16.")
+    parser.add_argument('--llm_endpoint', type=str, nargs='+', default=['localhost:8000'], help="Base URL(s) for the LLM API; requests are balanced over several servers given as separate or comma-separated values.")
+    parser.add_argument('--max_retries', type=int, default=2, help="Retries with backoff of a request failing with a connection error, 429 or 5xx, before it is tried on another endpoint.")
+    parser.add_argument('--health_check_interval', type=float, default=30, help="Seconds between health checks of the LLM endpoints (0 disables them).")
     parser.add_argument('--model', type=str, default='Meta-Llama-3-8B-Instruct', help="Model name to use for the LLM.")
+    parser.add_argument('--shard_size_mb', type=float, default=0, help="Write gzipped output shards of this uncompressed size plus a shard index; 0 writes a single JSONL file.")
+    parser.add_argument('--prefilter', type=str, default=None, choices=['document', 'chunk'], help="Drop documents or chunks that look like garbage text before sending them to the LLM.")
+    parser.add_argument('--dictionary_path', type=str, default=None, help="Word list (one word per line) for the pre-filter's dictionary-word ratio; defaults to a bundled list of common English words.")
+    parser.add_argument('--quarantine_path', type=str, default=None, help="JSONL file receiving the documents dropped by the pre-filter.")
+    parser.add_argument('--artifact_threshold', type=float, default=None, help="Repair chunks with rules first and only send those with more artifacts per 100 words than this to the LLM (e.g. 1.0).")
+    parser.add_argument('--journal_path', type=str, default=None, help="Progress journal of the completed entries; defaults to the output path plus '.progress.jsonl'.")
+    parser.add_argument('--resume', action='store_true', help="Continue an interrupted run from its progress journal instead of starting over.")
 
     args = parser.parse_args()
     
-    # Configure OpenAI client with base URL and API key
-    client.base_url = args.llm_endpoint
+    global backend, concurrency_limiter, count_tokens, correction_cache, output_token_ratio, output_token_slack, correction_mode
+    correction_mode = args.correction_mode
+    output_token_ratio, output_token_slack = args.output_token_ratio, args.output_token_slack
+    if args.adaptive_concurrency:
+        concurrency_limiter = AdaptiveLimiter(initial_limit=min(8, args.max_workers), max_limit=args.max_workers)
+    if args.backend == 'openai':
+        backend = create_backend('openai', args.model, parse_endpoints(args.llm_endpoint), api_key="YOUR_API_KEY",
+                                 limiter=concurrency_limiter, health_check_interval=args.health_check_interval, max_retries=args.max_retries)
+    else:
+        backend = create_backend('transformers', args.model, max_batch_size=args.batch_size, torch_dtype=args.torch_dtype)
+    count_tokens = load_token_counter(args.tokenizer)
+    if args.correction_cache_path:
+        correction_cache = CorrectionCache(args.correction_cache_path)
 
-    process_jsonl(args.input_path, args.output_path, args.model, args.chunk_size, args.split_size, args.max_workers)
+    process_jsonl(args.input_path, args.output_path, args.model, args.chunk_size, args.split_size, args.max_workers, args.shard_size_mb,
+                  args.prefilter, args.dictionary_path, args.quarantine_path, args.journal_path, args.resume,
+                  args.artifact_threshold)
+    backend.close()
 
 if __name__ == "__main__":
     main()
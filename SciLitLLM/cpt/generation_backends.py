@@ -0,0 +1,174 @@
+"""Chat generation backends: OpenAI-compatible servers, or a local transformers model batching concurrent calls."""
+import queue
+import threading
+import concurrent.futures
+from collections import namedtuple
+
+# Generated text, 'stop' if generation ended by itself or 'length' if it hit `max_tokens`, and the log-probabilities
+# of the most likely first tokens as a {token: logprob} dict when they were requested
+GenerationResult = namedtuple('GenerationResult', ['text', 'finish_reason', 'top_logprobs'], defaults=(None,))
+
+
+class PromptTooLongError(Exception):
+    """Raised when a prompt does not fit in the context of the model."""
+
+
+class GenerationBackend:
+    """Thread-safe chat generation: `generate(messages, max_tokens, top_logprobs)` returns a `GenerationResult`, with the
+    `top_logprobs` most likely first tokens if it is not 0."""
+
+    def generate(self, messages, max_tokens=None, top_logprobs=0):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class OpenAIBackend(GenerationBackend):
+    """Generation through the chat completion API of one or more OpenAI-compatible servers."""
+
+    def __init__(self, model, pool):
+        self.model = model
+        self.pool = pool
+
+    def generate(self, messages, max_tokens=None, top_logprobs=0):
+        from openai import BadRequestError
+        kwargs = {'max_tokens': max_tokens} if max_tokens else {}
+        if top_logprobs:
+            kwargs.update(logprobs=True, top_logprobs=top_logprobs)
+        try:
+            completion = self.pool.create_chat_completion(model=self.model, messages=messages, **kwargs)
+        except BadRequestError as e:
+            raise PromptTooLongError(str(e)) from e
+        choice = completion.choices[0]
+        first_token_logprobs = None
+        if top_logprobs and choice.logprobs and choice.logprobs.content:
+            first_token_logprobs = {candidate.token: candidate.logprob for candidate in choice.logprobs.content[0].top_logprobs}
+        return GenerationResult(choice.message.content, choice.finish_reason, first_token_logprobs)
+
+    def close(self):
+        self.pool.close()
+
+
+class TransformersBackend(GenerationBackend):
+    """Greedy generation with a local `transformers` model, batching up to `max_batch_size` concurrent `generate` calls."""
+
+    def __init__(self, model_name, max_batch_size=8, max_wait=0.05, max_new_tokens=1024, device=None, torch_dtype=None):
+        try:
+            import torch
+            from transformers import AutoModelForCausalLM, AutoTokenizer
+        except ImportError as e:
+            raise ImportError("The transformers backend requires the 'torch' and 'transformers' packages.") from e
+        self.torch = torch
+        self.device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name, padding_side='left')
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        dtype = getattr(torch, torch_dtype) if torch_dtype else 'auto'
+        self.model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=dtype).to(self.device).eval()
+        self.max_context = getattr(self.model.config, 'max_position_embeddings', None)
+        eos_token_id = self.model.generation_config.eos_token_id
+        if eos_token_id is None:
+            eos_token_id = self.tokenizer.eos_token_id
+        self.eos_token_ids = set(eos_token_id if isinstance(eos_token_id, list) else [eos_token_id])
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.max_new_tokens = max_new_tokens
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self._serve, daemon=True)
+        self.worker.start()
+
+    def format_prompt(self, messages):
+        if self.tokenizer.chat_template:
+            return self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        return "\n\n".join(message['content'] for message in messages) + "\n\n"
+
+    def generate(self, messages, max_tokens=None, top_logprobs=0):
+        future = concurrent.futures.Future()
+        self.requests.put((self.format_prompt(messages), max_tokens or self.max_new_tokens, top_logprobs, future))
+        return future.result()
+
+    def _next_batch(self):
+        """Block for a first request, then collect more for up to `max_wait` seconds. Returns None once closed."""
+        batch = [self.requests.get()]
+        while batch[-1] is not None and len(batch) < self.max_batch_size:
+            try:
+                batch.append(self.requests.get(timeout=self.max_wait))
+            except queue.Empty:
+                break
+        if batch[-1] is None:
+            for _, _, _, future in batch[:-1]:
+                future.set_exception(RuntimeError("Generation backend closed."))
+            return None
+        return batch
+
+    def _serve(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                prompts, max_tokens, top_logprobs, _ = zip(*batch)
+                results = self._generate_batch(prompts, max_tokens, top_logprobs)
+            except Exception as e:
+                for _, _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, _, _, future), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def _generate_batch(self, prompts, max_tokens, top_logprobs):
+        inputs = self.tokenizer(list(prompts), return_tensors='pt', padding=True, add_special_tokens=False,
+                                return_token_type_ids=False).to(self.device)
+        prompt_length = inputs['input_ids'].shape[1]
+        if self.max_context and prompt_length + max(max_tokens) > self.max_context:
+            # Generate the prompts one by one, so only those that do not fit fail
+            if len(prompts) > 1:
+                return [self._generate_or_error(*request) for request in zip(prompts, max_tokens, top_logprobs)]
+            raise PromptTooLongError(f"Prompt of {prompt_length} tokens plus {max_tokens[0]} output tokens exceeds the context of {self.max_context} tokens.")
+        with self.torch.no_grad():
+            output = self.model.generate(**inputs, max_new_tokens=max(max_tokens), do_sample=False,
+                                         pad_token_id=self.tokenizer.pad_token_id,
+                                         output_scores=any(top_logprobs), return_dict_in_generate=True)
+        first_token_logprobs = [None] * len(prompts)
+        if any(top_logprobs):
+            logprobs = self.torch.log_softmax(output.scores[0].float(), dim=-1)
+            values, indices = logprobs.topk(max(top_logprobs), dim=-1)
+            for i, k in enumerate(top_logprobs):
+                if k:
+                    first_token_logprobs[i] = {self.tokenizer.decode([token_id]): logprob
+                                               for token_id, logprob in zip(indices[i, :k].tolist(), values[i, :k].tolist())}
+        results = []
+        for ids, cap, candidates in zip(output.sequences[:, prompt_length:].tolist(), max_tokens, first_token_logprobs):
+            ids = ids[:cap]
+            end = next((i for i, token_id in enumerate(ids) if token_id in self.eos_token_ids), None)
+            if end is None:
+                results.append(GenerationResult(self.tokenizer.decode(ids, skip_special_tokens=True), 'length', candidates))
+            else:
+                results.append(GenerationResult(self.tokenizer.decode(ids[:end], skip_special_tokens=True), 'stop', candidates))
+        return results
+
+    def _generate_or_error(self, prompt, max_tokens, top_logprobs):
+        try:
+            return self._generate_batch([prompt], [max_tokens], [top_logprobs])[0]
+        except PromptTooLongError as e:
+            return e
+
+    def close(self):
+        self.requests.put(None)
+        self.worker.join()
+
+
+def create_backend(name, model, endpoints=("http://localhost:8000/v1",), api_key="EMPTY", limiter=None,
+                   health_check_interval=30.0, max_retries=2, **transformers_kwargs):
+    """Create the 'openai' backend for `model` served at `endpoints`, or the in-process 'transformers' backend."""
+    if name == 'openai':
+        from llm_client import EndpointPool
+        return OpenAIBackend(model, EndpointPool(list(endpoints), api_key=api_key, health_check_interval=health_check_interval,
+                                                 limiter=limiter, max_retries=max_retries))
+    if name == 'transformers':
+        return TransformersBackend(model, **transformers_kwargs)
+    raise ValueError(f"Unknown generation backend '{name}', expected 'openai' or 'transformers'.")
@@ -0,0 +1,173 @@
+"""Size-capped, gzip-compressed JSONL shards with a shard index."""
+import os
+import gzip
+import json
+import zlib
+
+INDEX_SUFFIX = ".index.json"
+
+
+def index_path_of(prefix):
+    return prefix + INDEX_SUFFIX
+
+
+def load_shard_index(index_path):
+    """Return the shard index as a dict with a `shards` list of {path, records, bytes, compressed_bytes}."""
+    with open(index_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class ShardedJsonlWriter:
+    """File-like writer of JSONL lines that rolls over to a new gzip shard after `max_shard_bytes` uncompressed bytes."""
+
+    def __init__(self, prefix, max_shard_bytes, mode='w'):
+        self.prefix = prefix
+        self.max_shard_bytes = max_shard_bytes
+        self.index_path = index_path_of(prefix)
+        self.shards = []
+        if mode == 'a' and os.path.exists(self.index_path):
+            index = load_shard_index(self.index_path)
+            if index['shards'] and not _gzip_complete(os.path.join(os.path.dirname(prefix), index['shards'][-1]['path'])):
+                # Left open by a killed run: rewrite it with its indexed records and a gzip trailer before appending
+                truncate_shards(prefix, index['records'])
+                index = load_shard_index(self.index_path)
+            self.shards = index['shards']
+        self.file = None
+        self.at_line_start = True
+
+    def _open_shard(self):
+        shard_path = f"{self.prefix}-{len(self.shards):05d}.jsonl.gz"
+        self.file = gzip.open(shard_path, 'wt', encoding='utf-8')
+        self.shards.append({'path': os.path.basename(shard_path), 'records': 0, 'bytes': 0, 'compressed_bytes': 0})
+
+    def _close_shard(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            self._update_compressed_size()
+
+    def _update_compressed_size(self):
+        shard = self.shards[-1]
+        shard['compressed_bytes'] = os.path.getsize(os.path.join(os.path.dirname(self.prefix), shard['path']))
+
+    def tell(self):
+        """Return the number of records written so far, the position accepted by `truncate_jsonl_output`."""
+        return sum(shard['records'] for shard in self.shards)
+
+    def write(self, text):
+        """Write text to the current shard. A line is never split across shards, so it may be written in pieces."""
+        if self.file is None or (self.at_line_start and self.shards[-1]['bytes'] >= self.max_shard_bytes):
+            self._close_shard()
+            self._open_shard()
+        self.file.write(text)
+        if text:
+            self.at_line_start = text.endswith("\n")
+        shard = self.shards[-1]
+        shard['records'] += text.count("\n")
+        shard['bytes'] += len(text.encode('utf-8'))
+
+    def flush(self):
+        if self.file is not None:
+            self.file.flush()
+            self._update_compressed_size()
+        self._write_index()
+
+    def _write_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'records': sum(shard['records'] for shard in self.shards),
+                'bytes': sum(shard['bytes'] for shard in self.shards),
+                'shards': self.shards,
+            }, f, indent=2)
+        os.replace(tmp_path, self.index_path)
+
+    def close(self):
+        self._close_shard()
+        self._write_index()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def shard_prefix(output_path):
+    return output_path[:-len('.jsonl')] if output_path.endswith('.jsonl') else output_path
+
+
+def open_jsonl_writer(output_path, shard_size_mb=0, mode='w'):
+    """Open a plain JSONL file, or a sharded writer with `output_path` (minus `.jsonl`) as prefix if `shard_size_mb` > 0."""
+    if shard_size_mb > 0:
+        return ShardedJsonlWriter(shard_prefix(output_path), int(shard_size_mb * 1024 * 1024), mode)
+    return open(output_path, mode, encoding='utf-8')
+
+
+def _read_complete_lines(shard_path):
+    """Return the complete lines of a gzip shard, tolerating a stream cut short by a crash."""
+    with open(shard_path, 'rb') as f:
+        data = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(f.read())
+    return [line for line in data.decode('utf-8', errors='ignore').splitlines(keepends=True) if line.endswith("\n")]
+
+
+def _gzip_complete(shard_path):
+    """Return whether a gzip shard ends with its end-of-stream marker, i.e. was closed."""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    with open(shard_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            decompressor.decompress(chunk)
+    return decompressor.eof
+
+
+def truncate_shards(prefix, records):
+    """Cut the shards of `prefix` down to their first `records` records, rewriting the shard holding the cut."""
+    index_path = index_path_of(prefix)
+    shard_dir = os.path.dirname(prefix)
+    shards = load_shard_index(index_path)['shards'] if os.path.exists(index_path) else []
+    kept = []
+    for i, shard in enumerate(shards):
+        if records <= 0:
+            break
+        if shard['records'] <= records and i < len(shards) - 1:
+            # Shards before the last one were closed when the writer rolled over
+            kept.append(shard)
+            records -= shard['records']
+            continue
+        shard_path = os.path.join(shard_dir, shard['path'])
+        lines = _read_complete_lines(shard_path)[:records]
+        tmp_path = shard_path + '.tmp'
+        with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+            f.writelines(lines)
+        os.replace(tmp_path, shard_path)
+        kept.append({'path': shard['path'], 'records': len(lines), 'bytes': sum(len(line.encode('utf-8')) for line in lines),
+                     'compressed_bytes': os.path.getsize(shard_path)})
+        records -= len(lines)
+    writer = ShardedJsonlWriter(prefix, 0)
+    writer.shards = kept
+    writer._write_index()
+
+
+def truncate_jsonl_output(output_path, shard_size_mb, position):
+    """Cut an output opened with `open_jsonl_writer` back to a position returned by its `tell()`."""
+    if shard_size_mb > 0:
+        truncate_shards(shard_prefix(output_path), position)
+    elif os.path.exists(output_path):
+        with open(output_path, 'r+b') as f:
+            f.truncate(position)
+
+
+def jsonl_shard_paths(path):
+    """Return the files behind a JSONL input: the shards listed by an index file, or the path itself."""
+    if path.endswith(INDEX_SUFFIX):
+        shard_dir = os.path.dirname(path)
+        return [os.path.join(shard_dir, shard['path']) for shard in load_shard_index(path)['shards']]
+    return [path]
+
+
+def iter_jsonl_lines(path):
+    """Yield the lines of a JSONL file, a gzipped JSONL file, or all shards of a shard index, in order."""
+    for shard_path in jsonl_shard_paths(path):
+        opener = gzip.open if shard_path.endswith('.gz') else open
+        with opener(shard_path, 'rt', encoding='utf-8') as f:
+            yield from f
@@ -0,0 +1,204 @@
+"""Client for a pool of OpenAI-compatible LLM servers (e.g. vLLM replicas), with retries and an adaptive concurrency limit."""
+import time
+import random
+import threading
+from urllib.parse import urlparse
+from openai import OpenAI, APIConnectionError, InternalServerError, RateLimitError
+
+# Errors that count against an endpoint; other errors (e.g. a bad request) are the request's fault
+ENDPOINT_ERRORS = (APIConnectionError, InternalServerError)
+# Errors that mean the servers are overloaded (timeouts are connection errors); requests failing with them are retried
+OVERLOAD_ERRORS = (APIConnectionError, InternalServerError, RateLimitError)
+
+
+def normalize_base_url(endpoint):
+    """Return the base URL of an endpoint given as `host:port`, `http://host:port` or a full `.../v1` URL."""
+    if '://' not in endpoint:
+        endpoint = 'http://' + endpoint
+    if urlparse(endpoint).path in ('', '/'):
+        endpoint = endpoint.rstrip('/') + '/v1'
+    return endpoint
+
+
+def parse_endpoints(values):
+    """Return the base URLs of a list of endpoints, each value possibly holding several comma-separated endpoints."""
+    return [normalize_base_url(endpoint.strip()) for value in values for endpoint in value.split(',') if endpoint.strip()]
+
+
+class AdaptiveLimiter:
+    """Limit on the number of requests in flight, adjusted by additive increase and multiplicative decrease (AIMD) of
+    the per-token latency and overload errors."""
+
+    def __init__(self, initial_limit=8, min_limit=1, max_limit=256, latency_tolerance=2.0, backoff=0.7, min_window=10):
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.min_window = min_window
+        self.in_flight = 0
+        self.latencies = []
+        self.base_latency = None
+        self.decreased_at = float('-inf')
+        self.latency_at_decrease = None  # p90 latency of the window that triggered the last decrease
+        self.slow_start = True
+        self.cooldown = 0  # successful requests to wait for before another decrease
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """Wait until fewer than `limit` requests are in flight, then count one more."""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def observe(self, latency, error=None, tokens=None):
+        """Record the outcome of a request: its latency in seconds and number of output tokens, or the error it failed with."""
+        now = time.monotonic()
+        with self.condition:
+            if error is not None:
+                if isinstance(error, OVERLOAD_ERRORS):
+                    self._decrease(now)
+                return
+            self.cooldown -= 1
+            if now - latency < self.decreased_at:
+                # Started before the last decrease, so it says nothing about the new limit
+                return
+            self.latencies.append(latency / tokens if tokens else latency)
+            if len(self.latencies) < max(int(self.limit), self.min_window):
+                return
+            latencies = sorted(self.latencies)
+            self.latencies = []
+            p90 = latencies[int(0.9 * (len(latencies) - 1))]
+            if self.latency_at_decrease is not None and p90 > self.latency_at_decrease * (1 + self.backoff) / 2:
+                # Latency did not fall with the limit: the requests themselves got slower, not the servers queueing
+                self.base_latency = p90
+            self.latency_at_decrease = None
+            self.base_latency = p90 if self.base_latency is None else min(self.base_latency, p90)
+            if p90 > self.latency_tolerance * self.base_latency:
+                if self._decrease(now):
+                    self.latency_at_decrease = p90
+            else:
+                self.limit = min(self.max_limit, self.limit * 2 if self.slow_start else self.limit + 1)
+                self.condition.notify_all()
+
+    def _decrease(self, now):
+        if self.cooldown > 0:
+            return False
+        self.slow_start = False
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        self.cooldown = int(self.limit)
+        self.latencies = []
+        self.decreased_at = now
+        return True
+
+
+class Endpoint:
+    def __init__(self, base_url, api_key, timeout=None, max_retries=2):
+        self.base_url = base_url
+        self.client = OpenAI(api_key=api_key, base_url=base_url, timeout=timeout, max_retries=max_retries)
+        self.outstanding = 0
+        self.consecutive_failures = 0
+        self.healthy = True
+
+
+class EndpointPool:
+    """Least-outstanding-requests routing over several endpoints, with passive and active health checking and retries."""
+
+    def __init__(self, base_urls, api_key="YOUR_API_KEY", max_failures=3, health_check_interval=30.0, timeout=None, limiter=None,
+                 max_retries=2, retry_rounds=2, retry_backoff=2.0):
+        if not base_urls:
+            raise ValueError("At least one LLM endpoint is required.")
+        self.endpoints = [Endpoint(base_url, api_key, timeout, max_retries) for base_url in base_urls]
+        self.max_failures = max_failures
+        self.retry_rounds = retry_rounds
+        self.retry_backoff = retry_backoff
+        self.limiter = limiter
+        self.health_check_interval = health_check_interval
+        self.lock = threading.Lock()
+        self.closed = threading.Event()
+        self.health_thread = None
+        if health_check_interval > 0:
+            self.health_thread = threading.Thread(target=self._health_check_loop, daemon=True)
+            self.health_thread.start()
+
+    def acquire(self, exclude=()):
+        """Pick the healthy endpoint with the fewest outstanding requests (any endpoint if none is healthy) and count a request on it."""
+        with self.lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude] or self.endpoints
+            candidates = [endpoint for endpoint in candidates if endpoint.healthy] or candidates
+            endpoint = min(candidates, key=lambda endpoint: endpoint.outstanding)
+            endpoint.outstanding += 1
+            return endpoint
+
+    def release(self, endpoint, error=None):
+        """Finish a request on an endpoint, ejecting the endpoint after too many consecutive endpoint errors."""
+        with self.lock:
+            endpoint.outstanding -= 1
+            if isinstance(error, ENDPOINT_ERRORS):
+                endpoint.consecutive_failures += 1
+                if endpoint.healthy and endpoint.consecutive_failures >= self.max_failures:
+                    endpoint.healthy = False
+                    print(f"Ejected LLM endpoint {endpoint.base_url}: {error}")
+            elif error is None:
+                endpoint.consecutive_failures = 0
+
+    def create_chat_completion(self, **kwargs):
+        """Send a chat completion request, retrying on another endpoint after an overload error, and on all endpoints
+        again after a backoff once every endpoint failed."""
+        tried = []
+        rounds = 0
+        while True:
+            endpoint = self.acquire(exclude=tried)
+            start = time.monotonic()
+            try:
+                completion = endpoint.client.chat.completions.create(**kwargs)
+            except Exception as e:
+                self.release(endpoint, e)
+                if self.limiter is not None:
+                    self.limiter.observe(time.monotonic() - start, e)
+                if not isinstance(e, OVERLOAD_ERRORS):
+                    raise
+                tried.append(endpoint)
+                if len(tried) >= len(self.endpoints):
+                    if rounds >= self.retry_rounds:
+                        raise
+                    time.sleep(self.retry_backoff * 2 ** rounds * random.uniform(0.5, 1.5))
+                    rounds += 1
+                    tried = []
+                continue
+            self.release(endpoint)
+            if self.limiter is not None:
+                self.limiter.observe(time.monotonic() - start, tokens=completion.usage.completion_tokens if completion.usage else None)
+            return completion
+
+    def check_health(self, endpoint):
+        """Mark an endpoint healthy if it answers a model listing, unhealthy otherwise."""
+        try:
+            endpoint.client.with_options(timeout=10).models.list()
+            healthy = True
+        except Exception:
+            healthy = False
+        with self.lock:
+            if healthy and not endpoint.healthy:
+                print(f"Re-admitted LLM endpoint {endpoint.base_url}")
+            elif not healthy and endpoint.healthy:
+                print(f"Ejected LLM endpoint {endpoint.base_url}: health check failed")
+            endpoint.healthy = healthy
+            if healthy:
+                endpoint.consecutive_failures = 0
+
+    def _health_check_loop(self):
+        while not self.closed.wait(self.health_check_interval):
+            for endpoint in self.endpoints:
+                self.check_health(endpoint)
+
+    def close(self):
+        self.closed.set()
+        if self.health_thread is not None:
+            self.health_thread.join()
@@ -0,0 +1,61 @@
+"""On-disk cache of extracted PDF text, keyed by the sha256 of the PDF and the extractor version."""
+import os
+import gzip
+import json
+import hashlib
+import tempfile
+
+
+def file_sha256(path):
+    """Return the hex sha256 of a file's content."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+class ParseCache:
+    """Stores the page texts of each PDF as gzipped JSON under `<cache_dir>/<extractor version>/<sha[:2]>/<sha>.json.gz`."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = os.path.expanduser(cache_dir)
+
+    def _path(self, sha256, extractor_version):
+        return os.path.join(self.cache_dir, extractor_version, sha256[:2], f"{sha256}.json.gz")
+
+    def get(self, sha256, extractor_version):
+        """Return the cached page texts, or None on a miss or an unreadable entry."""
+        try:
+            with gzip.open(self._path(sha256, extractor_version), 'rt', encoding='utf-8') as f:
+                return json.load(f)['pages']
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, sha256, extractor_version, pages):
+        """Store the page texts of a PDF. The entry is written to a temporary file and renamed, so
+        concurrent writers and readers never see a partial entry."""
+        path = self._path(sha256, extractor_version)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as f:
+                json.dump({'pages': pages}, f)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def extract_pages_cached(extractor, pdf_path, cache=None, sha256=None):
+    """Return the page texts of a whole PDF, from the cache if possible, extracting and storing them otherwise."""
+    if cache is None:
+        return extractor.extract_pages(pdf_path)
+    sha256 = sha256 or file_sha256(pdf_path)
+    version = extractor.version()
+    pages = cache.get(sha256, version)
+    if pages is None:
+        pages = extractor.extract_pages(pdf_path)
+        cache.put(sha256, version, pages)
+    return pages
@@ -0,0 +1,140 @@
+"""Registry of PDF text-extraction backends, PyPDF2 by default."""
+import importlib
+import importlib.util
+
+EXTRACTORS = {}
+
+# Preference order for `get_extractor("auto")`, fastest first.
+AUTO_ORDER = ["pypdfium2", "pymupdf", "pypdf", "pypdf2", "pdfminer"]
+
+
+def register_extractor(cls):
+    """Class decorator adding an extractor to the registry under its `name`."""
+    EXTRACTORS[cls.name] = cls
+    return cls
+
+
+class PDFExtractor:
+    """Base class of the extraction backends. `module` is the import name of the backing library."""
+    name = None
+    module = None
+
+    @classmethod
+    def is_available(cls):
+        return importlib.util.find_spec(cls.module) is not None
+
+    def version(self):
+        """Return an identifier of the backend and library version, e.g. `pypdf2-3.0.1`."""
+        library = importlib.import_module(self.module)
+        return f"{self.name}-{getattr(library, '__version__', 'unknown')}"
+
+    def num_pages(self, pdf_path):
+        raise NotImplementedError()
+
+    def extract_pages(self, pdf_path, start=0, end=None):
+        """Return the text of pages [start, end) of a PDF, one string per page."""
+        raise NotImplementedError()
+
+
+@register_extractor
+class PyPDF2Extractor(PDFExtractor):
+    name = "pypdf2"
+    module = "PyPDF2"
+
+    def num_pages(self, pdf_path):
+        from PyPDF2 import PdfReader
+        return len(PdfReader(pdf_path).pages)
+
+    def extract_pages(self, pdf_path, start=0, end=None):
+        from PyPDF2 import PdfReader
+        return [page.extract_text() or "" for page in PdfReader(pdf_path).pages[start:end]]
+
+
+@register_extractor
+class PyPDFExtractor(PDFExtractor):
+    name = "pypdf"
+    module = "pypdf"
+
+    def num_pages(self, pdf_path):
+        from pypdf import PdfReader
+        return len(PdfReader(pdf_path).pages)
+
+    def extract_pages(self, pdf_path, start=0, end=None):
+        from pypdf import PdfReader
+        return [page.extract_text() or "" for page in PdfReader(pdf_path).pages[start:end]]
+
+
+@register_extractor
+class PyMuPDFExtractor(PDFExtractor):
+    name = "pymupdf"
+    module = "pymupdf"
+
+    def num_pages(self, pdf_path):
+        import pymupdf
+        with pymupdf.open(pdf_path) as doc:
+            return doc.page_count
+
+    def extract_pages(self, pdf_path, start=0, end=None):
+        import pymupdf
+        with pymupdf.open(pdf_path) as doc:
+            return [doc[i].get_text() for i in range(doc.page_count)[start:end]]
+
+
+@register_extractor
+class PyPdfium2Extractor(PDFExtractor):
+    name = "pypdfium2"
+    module = "pypdfium2"
+
+    def version(self):
+        import pypdfium2
+        return f"{self.name}-{pypdfium2.version.PYPDFIUM_INFO}"
+
+    def num_pages(self, pdf_path):
+        import pypdfium2
+        doc = pypdfium2.PdfDocument(pdf_path)
+        try:
+            return len(doc)
+        finally:
+            doc.close()
+
+    def extract_pages(self, pdf_path, start=0, end=None):
+        import pypdfium2
+        doc = pypdfium2.PdfDocument(pdf_path)
+        try:
+            return [doc[i].get_textpage().get_text_range() for i in range(len(doc))[start:end]]
+        finally:
+            doc.close()
+
+
+@register_extractor
+class PDFMinerExtractor(PDFExtractor):
+    name = "pdfminer"
+    module = "pdfminer"
+
+    def num_pages(self, pdf_path):
+        from pdfminer.pdfpage import PDFPage
+        with open(pdf_path, 'rb') as f:
+            return sum(1 for _ in PDFPage.get_pages(f))
+
+    def extract_pages(self, pdf_path, start=0, end=None):
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LTTextContainer
+        page_numbers = set(range(self.num_pages(pdf_path))[start:end])
+        return ["".join(element.get_text() for element in layout if isinstance(element, LTTextContainer))
+                for layout in extract_pages(pdf_path, page_numbers=page_numbers)]
+
+
+def available_extractors():
+    """Return the names of the registered extractors whose library is installed."""
+    return [name for name, cls in EXTRACTORS.items() if cls.is_available()]
+
+
+def get_extractor(name="pypdf2"):
+    """Return an extractor instance by name; `auto` picks the fastest installed backend."""
+    if name == "auto":
+        name = next(candidate for candidate in AUTO_ORDER if EXTRACTORS[candidate].is_available())
+    if name not in EXTRACTORS:
+        raise ValueError(f"Unknown extractor '{name}'. Choose from {', '.join(EXTRACTORS)} or 'auto'.")
+    if not EXTRACTORS[name].is_available():
+        raise ImportError(f"Extractor '{name}' requires the '{EXTRACTORS[name].module}' package to be installed.")
+    return EXTRACTORS[name]()
@@ -1,45 +1,226 @@
 import os
 import argparse
 import json
-from concurrent.futures import ProcessPoolExecutor
-from PyPDF2 import PdfReader
+import signal
+import resource
 from tqdm import tqdm
+from worker_pool import DeadlinePool
+from pdf_extractors import EXTRACTORS, get_extractor
+from parse_cache import ParseCache, file_sha256, extract_pages_cached
+from jsonl_shards import open_jsonl_writer
+from boilerplate import CorpusLineStats, strip_boilerplate
 
-def process_pdf(pdf_path):
-    """Extract text from a PDF and return a tuple of the file name, success status, and text content."""
-    file_name = os.path.basename(pdf_path)
+class PDFTimeoutError(BaseException):
+    """Raised in a worker when a PDF exceeds its wall-clock budget; not an `Exception`, so extractors cannot swallow it."""
+
+def _raise_timeout(signum, frame):
+    raise PDFTimeoutError()
+
+_task_timeout = 0
+_hash_files = False
+# Seconds past the budget after which the parent kills a worker the alarm could not stop (e.g. inside a C extension)
+KILL_GRACE = 5
+_extractor = None
+_cache = None
+
+def init_worker(timeout=0, max_memory_mb=0, extractor="pypdf2", cache_dir=None, hash_files=False):
+    """Set the per-task wall-clock budget, the address-space ceiling, the extraction backend and the parse cache of a
+    pool worker, and whether it hashes the PDFs it parses (for the manifest)."""
+    global _task_timeout, _extractor, _cache, _hash_files
+    _task_timeout = timeout
+    _hash_files = hash_files
+    _extractor = get_extractor(extractor)
+    _cache = ParseCache(cache_dir) if cache_dir else None
+    signal.signal(signal.SIGALRM, _raise_timeout)
+    if max_memory_mb > 0:
+        limit = max_memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def run_with_timeout(func, *args):
+    """Run `func(*args)` within the worker's wall-clock budget and return (success, result, failure reason)."""
+    if _task_timeout > 0:
+        signal.setitimer(signal.ITIMER_REAL, _task_timeout)
     try:
-        reader = PdfReader(pdf_path)
-        text_content = []
-        for page in reader.pages:
-            text = page.extract_text()
-            if text:
-                text_content.append(text)
-        return (file_name, True, "\n".join(text_content))
+        return True, func(*args), None
+    except PDFTimeoutError:
+        return False, None, f"timed out after {_task_timeout}s"
+    except MemoryError:
+        # Left to the pool, which replaces the worker since it may be the one leaking
+        raise
     except Exception as e:
-        print(f"Error processing {pdf_path}: {e}")
-        return (file_name, False, None)
+        return False, None, f"{type(e).__name__}: {e}"
+    finally:
+        if _task_timeout > 0:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+def current_extractor():
+    """Return the extraction backend of this process (PyPDF2 unless set by `init_worker`)."""
+    global _extractor
+    if _extractor is None:
+        _extractor = get_extractor()
+    return _extractor
+
+def extract_pages(pdf_path, start=0, end=None, sha256=None):
+    """Extract the texts of pages [start, end) of a PDF. Whole PDFs go through the parse cache when one is set."""
+    if start == 0 and end is None:
+        return extract_pages_cached(current_extractor(), pdf_path, _cache, sha256)
+    return current_extractor().extract_pages(pdf_path, start, end)
+
+def process_pdf_task(task):
+    """Extract the page texts of a (pdf_path, part_id, num_parts, start, end, sha256) task and return the task, with
+    the sha256 of a whole PDF filled in if the manifest or the parse cache needs it, its result and failure reason."""
+    pdf_path, part_id, num_parts, start, end, sha256 = task
+    if sha256 is None and start == 0 and end is None and (_hash_files or _cache is not None):
+        success, sha256, reason = run_with_timeout(file_sha256, pdf_path)
+        if not success:
+            return task, False, None, reason
+        task = (pdf_path, part_id, num_parts, start, end, sha256)
+    success, pages, reason = run_with_timeout(extract_pages, pdf_path, start, end, sha256)
+    return task, success, pages, reason
 
-def main(pdf_folder, output_path):
-    """Main function to process all PDFs in a folder and save the output to a JSONL file."""
+def count_pages(pdf_path, sha256=None):
+    """Return the PDF path, its number of pages (0 if the PDF cannot be opened or is already in the parse cache) and
+    its sha256 if the manifest or the parse cache needs it."""
+    if sha256 is None and (_hash_files or _cache is not None):
+        sha256 = file_sha256(pdf_path)
+    if _cache is not None and _cache.get(sha256, current_extractor().version()) is not None:
+        return pdf_path, 0, sha256
+    success, num_pages, reason = run_with_timeout(current_extractor().num_pages, pdf_path)
+    if not success:
+        print(f"Error counting pages of {pdf_path}: {reason}")
+    return pdf_path, num_pages or 0, sha256
+
+def plan_tasks(page_counts, split_pages):
+    """Yield (pdf_path, part_id, num_parts, start, end, sha256) tasks from (pdf_path, num_pages, sha256) triples, split
+    into ranges of `split_pages` pages if `split_pages` > 0."""
+    for pdf_path, num_pages, sha256 in page_counts:
+        if split_pages <= 0 or num_pages <= split_pages:
+            yield (pdf_path, 0, 1, 0, None, sha256)
+            continue
+        starts = range(0, num_pages, split_pages)
+        for part_id, start in enumerate(starts):
+            yield (pdf_path, part_id, len(starts), start, min(start + split_pages, num_pages), sha256)
+
+def load_manifest(manifest_path):
+    """Load the parsing manifest as a dict from file name to its latest entry."""
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    manifest[entry['source']] = entry
+    return manifest
+
+def select_changed_pdfs(pdf_files, manifest, retry_failed=False):
+    """Return the PDFs that are new or changed since the manifest was written, with their size, mtime and (if known) sha256."""
+    selected = {}
+    for pdf_path in pdf_files:
+        entry = manifest.get(os.path.basename(pdf_path))
+        stat = os.stat(pdf_path)
+        fingerprint = {'sha256': None, 'size': stat.st_size, 'mtime': stat.st_mtime}
+        if entry is not None and not (retry_failed and not entry['success']):
+            if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+                continue
+            fingerprint['sha256'] = file_sha256(pdf_path)
+            if entry['sha256'] == fingerprint['sha256']:
+                continue
+        selected[pdf_path] = fingerprint
+    return selected
+
+def main(pdf_folder, output_path, split_pages=0, manifest_path=None, retry_failed=False,
+         timeout=0, max_tasks_per_child=None, max_memory_mb=0, extractor="pypdf2", cache_dir=None, shard_size_mb=0,
+         remove_boilerplate=False, boilerplate_stats_path=None, boilerplate_min_documents=50, recycle_memory_mb=0):
+    """Main function to process all PDFs in a folder and stream the output to a JSONL file."""
     pdf_files = [os.path.join(pdf_folder, file) for file in os.listdir(pdf_folder) if file.lower().endswith('.pdf')]
 
-    processed_files = []
+    fingerprints = {}
+    output_mode = 'w'
+    if manifest_path:
+        fingerprints = select_changed_pdfs(pdf_files, load_manifest(manifest_path), retry_failed)
+        print(f"Skipping {len(pdf_files) - len(fingerprints)} PDFs unchanged since the last run.")
+        pdf_files = list(fingerprints)
+        output_mode = 'a'
+
+    extractor = get_extractor(extractor)
+    cache = ParseCache(cache_dir) if cache_dir else None
+    corpus_stats = CorpusLineStats.load(boilerplate_stats_path, boilerplate_min_documents) if remove_boilerplate else None
+    raw_chars = kept_chars = 0
+    pending_parts = {}
     cpu_count = os.cpu_count()
-    with ProcessPoolExecutor(max_workers=int(0.9 * cpu_count)) as executor:
-        for result in tqdm(executor.map(process_pdf, pdf_files), total=len(pdf_files), desc="Processing PDFs"):
-            processed_files.append(result)
+    with DeadlinePool(processes=max(1, int(0.9 * cpu_count)), initializer=init_worker, initargs=(timeout, max_memory_mb, extractor.name, cache_dir, bool(manifest_path)),
+                      maxtasksperchild=max_tasks_per_child, deadline=timeout + KILL_GRACE if timeout > 0 else 0,
+                      max_rss_mb=recycle_memory_mb) as pool, \
+            open_jsonl_writer(output_path, shard_size_mb, output_mode) as jsonl_file, \
+            open(manifest_path or os.devnull, 'a', encoding='utf-8') as manifest_file:
+        for pdf_path in pdf_files:
+            sha256 = fingerprints[pdf_path]['sha256'] if fingerprints else None
+            if split_pages > 0:
+                pool.submit(count_pages, pdf_path, sha256)
+            else:
+                pool.submit(process_pdf_task, (pdf_path, 0, 1, 0, None, sha256))
+        progress = tqdm(total=len(pdf_files), desc="Processing PDFs")
+        for func, args, result, failure in pool.results():
+            if func is count_pages:
+                # Page ranges are planned as soon as the page count of their PDF is known
+                for task in plan_tasks([result if failure is None else (args[0], 0, args[1])], split_pages):
+                    pool.submit(process_pdf_task, task)
+                continue
+            (pdf_path, part_id, num_parts, _, _, sha256), success, pages, reason = result if failure is None else (args[0], False, None, failure)
+            if num_parts > 1:
+                parts = pending_parts.setdefault(pdf_path, [None] * num_parts)
+                parts[part_id] = (success, pages, reason)
+                if any(part is None for part in parts):
+                    continue
+                del pending_parts[pdf_path]
+                success = all(part_success for part_success, _, _ in parts)
+                pages = [page for _, part_pages, _ in parts for page in part_pages] if success else None
+                reason = next((part_reason for _, _, part_reason in parts if part_reason), None)
+                if success and cache is not None:
+                    cache.put(sha256, extractor.version(), pages)
 
-    # Write the results to a JSONL file
-    with open(output_path, 'w', encoding='utf-8') as jsonl_file:
-        for file_name, success, text_content in processed_files:
+            progress.update(1)
+            if not success:
+                print(f"Error processing {pdf_path}: {reason}")
             if success:
-                jsonl_file.write(json.dumps({'text': text_content, 'meta_data': {'source': file_name}}) + "\n")
+                if corpus_stats is not None:
+                    raw_chars += sum(len(text) for text in pages)
+                    corpus_stats.update(pages)
+                    pages = strip_boilerplate(pages, corpus_stats)
+                    kept_chars += sum(len(text) for text in pages)
+                text_content = "\n".join(text for text in pages if text)
+                jsonl_file.write(json.dumps({'text': text_content, 'meta_data': {'source': os.path.basename(pdf_path)}}) + "\n")
+                jsonl_file.flush()
+            if manifest_path:
+                # Written after the output record, so a crash in between re-parses the file instead of losing it.
+                manifest_file.write(json.dumps({'source': os.path.basename(pdf_path), 'success': success, 'reason': reason, **fingerprints[pdf_path], 'sha256': sha256}) + "\n")
+                manifest_file.flush()
+        progress.close()
+
+    if corpus_stats is not None:
+        if boilerplate_stats_path:
+            corpus_stats.save(boilerplate_stats_path)
+        print(f"Removed {raw_chars - kept_chars} of {raw_chars} characters as boilerplate.")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process PDF files and extract text.")
     parser.add_argument('--pdf_folder', type=str, default='resources/raw_pdf', help="Path to the folder containing PDF files.")
     parser.add_argument('--output_path', type=str, default='resources/parse-text.jsonl', help="Path to the JSONL output file.")
+    parser.add_argument('--split_pages', type=int, default=0, help="Split PDFs with more pages than this into page ranges of this size processed in parallel (0 disables).")
+    parser.add_argument('--manifest_path', type=str, default=None, help="Path to the JSONL manifest of parsed PDFs; enables incremental parsing that appends to the output.")
+    parser.add_argument('--retry_failed', action='store_true', help="Parse again PDFs that failed in a previous run, even if unchanged.")
+    parser.add_argument('--timeout', type=float, default=0, help="Wall-clock budget in seconds for each PDF (or page range); 0 disables.")
+    parser.add_argument('--max_tasks_per_child', type=int, default=None, help="Replace each worker after it has processed this many tasks.")
+    parser.add_argument('--max_memory_mb', type=int, default=0, help="Address-space ceiling in MB for each worker; 0 disables.")
+    parser.add_argument('--recycle_memory_mb', type=int, default=0, help="Replace a worker left above this resident memory in MB after a task; 0 disables.")
+    parser.add_argument('--extractor', type=str, default='pypdf2', choices=list(EXTRACTORS) + ['auto'], help="Text-extraction backend.")
+    parser.add_argument('--cache_dir', type=str, default=None, help="Directory of the parse cache shared with the SFT pipeline; disabled by default.")
+    parser.add_argument('--shard_size_mb', type=float, default=0, help="Write gzipped output shards of this uncompressed size plus a shard index; 0 writes a single JSONL file.")
+    parser.add_argument('--remove_boilerplate', action='store_true', help="Remove running headers, footers, page numbers and corpus-wide banners from page edges.")
+    parser.add_argument('--boilerplate_stats_path', type=str, default=None, help="JSON file keeping the corpus-wide page-edge line counts across runs.")
+    parser.add_argument('--boilerplate_min_documents', type=int, default=50, help="Number of PDFs a page-edge line must appear in to be removed corpus-wide.")
 
     args = parser.parse_args()
-    main(args.pdf_folder, args.output_path)
+    main(args.pdf_folder, args.output_path, args.split_pages, args.manifest_path, args.retry_failed,
+         args.timeout, args.max_tasks_per_child, args.max_memory_mb, args.extractor, args.cache_dir, args.shard_size_mb,
+         args.remove_boilerplate, args.boilerplate_stats_path, args.boilerplate_min_documents, args.recycle_memory_mb)
@@ -1,10 +1,20 @@
+import os
+import sys
 import tqdm
-import openai
-from openai import OpenAI
 import random
 import json
 import re
+import math
+import hashlib
 import argparse
+import concurrent.futures
+
+# Make the generation backends of cpt/ importable
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from generation_backends import PromptTooLongError, create_backend
+from jsonl_shards import iter_jsonl_lines, jsonl_shard_paths
+from text_chunker import load_token_truncator
+from subset_sampling import Reservoir, StratifiedSampler, length_bucket
 
 SYSTEM_PROMPT = \
 """
@@ -21,6 +31,11 @@ After examining the extract:
 - Conclude with the score using the format: "Educational score:  <total points>"
 """
 
+# Same rubric, answered with the score alone so that it is read from the log-probabilities of a single token
+SCORE_ONLY_SYSTEM_PROMPT = SYSTEM_PROMPT[:SYSTEM_PROMPT.index("After examining the extract:")] + \
+"""After examining the extract, answer with the total points only, as a single digit from 0 to 5.
+"""
+
 USER_PROMPT = \
 """
 The extract:
@@ -40,6 +55,59 @@ def read_jsonl(filename):
         data = [json.loads(line) for line in f.readlines()]
     return data
 
+def iter_items(input_files):
+    """Yields (file, line) for the non-empty lines of JSONL files, gzipped JSONL files or the shards of shard indexes."""
+    for input_file in input_files:
+        for path in jsonl_shard_paths(input_file):
+            for line in iter_jsonl_lines(path):
+                if line.strip():
+                    yield path, line
+
+def sample_subset(input_files, subset_num, seed=0, stratify='none'):
+    """Returns a seeded sample of `subset_num` items (all items if `subset_num` <= 0), drawn in a single pass and
+    stratified by input file (or shard) or by length if `stratify` is 'file' or 'length'."""
+    if subset_num <= 0:
+        return [json.loads(line) for _, line in iter_items(input_files)]
+    if stratify == 'none':
+        reservoir = Reservoir(subset_num, random.Random(seed))
+        for _, line in iter_items(input_files):
+            reservoir.add(line)
+        return [json.loads(line) for line in reservoir.items]
+    sampler = StratifiedSampler(subset_num, seed)
+    for path, line in iter_items(input_files):
+        sampler.add(length_bucket(line) if stratify == 'length' else path, line)
+    return [json.loads(line) for line in sampler.sample()]
+
+def item_id(data_item):
+    """Identity of an item for resuming: its 'id' field, or a hash of its text."""
+    if 'id' in data_item:
+        return data_item['id']
+    return hashlib.sha1(data_item['text'].encode('utf-8')).hexdigest()
+
+def load_labelled_ids(filename):
+    """Returns the ids of the items already in an output file. A last line cut short by a crash is removed, and lines
+    without an id (e.g. written by an older version) are left alone but not counted."""
+    ids = set()
+    if not os.path.exists(filename):
+        return ids
+    with open(filename, 'rb+') as f:
+        offset = 0
+        for line in f:
+            try:
+                data_item = json.loads(line)
+            except ValueError:
+                if not line.endswith(b'\n'):
+                    f.truncate(offset)
+                    break
+                continue
+            if not line.endswith(b'\n'):
+                # Complete last record whose newline was not written
+                f.write(b'\n')
+            if isinstance(data_item, dict) and 'id' in data_item:
+                ids.add(data_item['id'])
+            offset += len(line)
+    return ids
+
 def parse_score(text):
     pattern = re.compile(r'Education(?:al)? score:\s*(\d+(?:\.\d+)?)(?:\/\d+)?')
     match = pattern.search(text)
@@ -53,67 +121,146 @@ def parse_score(text):
 
     return -1
 
+def score_distribution(top_logprobs, max_score=5):
+    """Returns the probabilities of the scores 0 to `max_score` among the most likely first tokens, normalized to sum to
+    1, or None if no score is among them. Tokens are compared without surrounding whitespace."""
+    score_tokens = {str(score): score for score in range(max_score + 1)}
+    probs = [0.0] * (max_score + 1)
+    for token, logprob in top_logprobs.items():
+        if token.strip() in score_tokens:
+            probs[score_tokens[token.strip()]] += math.exp(logprob)
+    total = sum(probs)
+    if total == 0:
+        return None
+    return [prob / total for prob in probs]
+
 class LLamaUser:
-    def __init__(self, input_file, output_file, base_url, llm_model, subset_num=50000):
-        self.input_file = input_file
+    def __init__(self, input_file, output_file, base_url, llm_model, subset_num=50000, backend=None, num_workers=16, seed=0,
+                 stratify='none', max_input_tokens=0, truncation_tokenizer=None, scoring='generate', top_logprobs=20):
+        # One or more JSONL files, gzipped JSONL files or shard indexes
+        self.input_files = [input_file] if isinstance(input_file, str) else list(input_file)
         self.output_file = output_file
-        self.client = OpenAI(
-            api_key = "EMPTY",
-            base_url = base_url
-        )
+        # OpenAI-compatible server at base_url unless another generation backend is given
+        self.backend = backend or create_backend('openai', llm_model, [base_url], api_key="EMPTY", health_check_interval=0, max_retries=2)
         self.model = llm_model
         self.subset_num = subset_num
+        self.num_workers = num_workers
+        self.seed = seed
+        self.stratify = stratify
+        # Token budget of the extract (0 for none), e.g. the 512-token window of the classifier trained on the labels
+        self.max_input_tokens = max_input_tokens
+        self.truncate = load_token_truncator(truncation_tokenizer) if max_input_tokens > 0 else None
+        # 'generate': justification then score, parsed from the text; 'logprobs': expected score of a one-token answer
+        self.scoring = scoring
+        self.top_logprobs = top_logprobs
     
     def predict(self, data_item):
+        if self.truncate is not None:
+            data_item['text'] = self.truncate(data_item['text'], self.max_input_tokens)
+        logprob_scoring = self.scoring == 'logprobs'
         try:
-            completion = self.client.chat.completions.create(
-                model=self.model,
+            result = self.backend.generate(
                 messages=[
                     {
                         "role": "system",
-                        "content": SYSTEM_PROMPT
+                        "content": SCORE_ONLY_SYSTEM_PROMPT if logprob_scoring else SYSTEM_PROMPT
                     },
                     {
                         "role": "user",
                         "content": USER_PROMPT.format(data_item['text'])
                     }
                 ],
+                **({'max_tokens': 1, 'top_logprobs': self.top_logprobs} if logprob_scoring else {}),
             )
-        except openai.BadRequestError:
+        except PromptTooLongError:
             data_item['text'] = data_item['text'][:int(len(data_item['text'])/2)]
             # half the len of input text
             return self.predict(data_item)
             
-        data_item['response'] = completion.choices[0].message.content
-        data_item['prediction'] = parse_score(data_item['response'])
+        data_item['response'] = result.text
+        if not logprob_scoring:
+            data_item['prediction'] = parse_score(data_item['response'])
+            return data_item
+        distribution = score_distribution(result.top_logprobs or {})
+        data_item['score_distribution'] = distribution
+        # Expected score, a finer training target than the most likely score
+        data_item['prediction'] = -1 if distribution is None else sum(score * prob for score, prob in enumerate(distribution))
         return data_item
     
     def run(self):
-        data = read_jsonl(self.input_file)
-        if self.subset_num > 0:
-            data = random.sample(data, self.subset_num)
-        for data_item in tqdm.tqdm(data):
-            data_item = self.predict(data_item)
-        write_jsonl(data, self.output_file)
+        """Labels the (seeded) subset, appending each labelled item to the output file and skipping those already in it."""
+        data = sample_subset(self.input_files, self.subset_num, self.seed, self.stratify)
+        for data_item in data:
+            data_item['id'] = item_id(data_item)
+        labelled_ids = load_labelled_ids(self.output_file)
+        data = [data_item for data_item in data if data_item['id'] not in labelled_ids]
+
+        progress = tqdm.tqdm(total=len(data) + len(labelled_ids), initial=len(labelled_ids))
+        with open(self.output_file, 'a') as f, concurrent.futures.ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            pending = set()
+            for data_item in data:
+                if len(pending) >= 2 * self.num_workers:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    self.write_results(done, f, progress)
+                pending.add(executor.submit(self.predict, data_item))
+            self.write_results(concurrent.futures.wait(pending)[0], f, progress)
+        progress.close()
+
+    def write_results(self, futures, f, progress):
+        for future in futures:
+            try:
+                data_item = future.result()
+            except Exception as e:
+                # Not written, so the item is labelled again on the next run
+                print(f"Error labelling item: {e}")
+                continue
+            f.write(json.dumps(data_item) + '\n')
+            f.flush()
+            progress.update(1)
 
 def main(args):
+    backend = None
+    if args.backend == 'transformers':
+        backend = create_backend('transformers', args.llm_model, max_batch_size=args.batch_size, torch_dtype=args.torch_dtype)
     user = LLamaUser(
         input_file = args.input_file,
         output_file = args.output_file,
         base_url = args.base_url,
         llm_model = args.llm_model,
+        subset_num = args.subset_num,
+        backend = backend,
+        num_workers = args.num_workers,
+        seed = args.seed,
+        stratify = args.stratify,
+        max_input_tokens = args.max_input_tokens,
+        truncation_tokenizer = args.truncation_tokenizer,
+        scoring = args.scoring,
+        top_logprobs = args.top_logprobs,
     )
     user.run()
+    user.backend.close()
 
 def parse_args():
     parser = argparse.ArgumentParser(description="A simple argument parser")
 
     parser.add_argument('--name', default='none', type=str)
-    parser.add_argument('--input_file', default='none', type=str)
+    parser.add_argument('--input_file', default=['none'], nargs='+', type=str)
     parser.add_argument('--output_file', default='none', type=str)
     parser.add_argument('--base_url', default='http://localhost:8000/v1', type=str)
     parser.add_argument('--llm_model', default='Meta-Llama-3-70B-Instruct', type=str)
+    parser.add_argument('--subset_num', default=50000, type=int)
+    parser.add_argument('--num_workers', default=16, type=int)
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--stratify', default='none', choices=['none', 'file', 'length'], type=str)
+    parser.add_argument('--max_input_tokens', default=0, type=int)
+    parser.add_argument('--truncation_tokenizer', default=None, type=str)
+    parser.add_argument('--scoring', default='generate', choices=['generate', 'logprobs'], type=str)
+    parser.add_argument('--top_logprobs', default=20, type=int)
+    parser.add_argument('--backend', default='openai', choices=['openai', 'transformers'], type=str)
+    parser.add_argument('--batch_size', default=8, type=int)
+    parser.add_argument('--torch_dtype', default=None, type=str)
     args = parser.parse_args()
     return args
 
-main(args=parse_args())
\ No newline at end of file
+if __name__ == '__main__':
+    main(args=parse_args())
@@ -0,0 +1,88 @@
+"""Seeded single-pass sampling of the labelling subset, holding only the sample in memory."""
+import math
+import random
+
+
+def length_bucket(line):
+    """Stratum of a JSONL line by length: the base-2 logarithm of its number of characters, rounded down."""
+    return int(math.log2(max(1, len(line))))
+
+
+class Reservoir:
+    """Uniform random sample of at most `size` items from a stream, drawn with Li's Algorithm L."""
+
+    def __init__(self, size, rng):
+        self.size = size
+        self.rng = rng
+        self.items = []
+        self.seen = 0
+        self.weight = 1.0
+        self.next_index = None  # stream index of the next item to put in the full reservoir
+
+    def _uniform(self):
+        u = self.rng.random()
+        while u == 0.0:
+            u = self.rng.random()
+        return u
+
+    def _skip(self):
+        self.weight *= math.exp(math.log(self._uniform()) / self.size)
+        self.next_index += int(math.log(self._uniform()) / math.log1p(-self.weight)) + 1
+
+    def add(self, item):
+        if len(self.items) < self.size:
+            self.items.append(item)
+            if len(self.items) == self.size:
+                self.next_index = self.seen
+                self._skip()
+        elif self.seen == self.next_index:
+            self.items[self.rng.randrange(self.size)] = item
+            self._skip()
+        self.seen += 1
+
+    def shrink(self, size):
+        """Keep a uniform subsample of `size` items, which is still a uniform sample of the stream so far."""
+        if size >= self.size:
+            return
+        self.size = size
+        if len(self.items) < size:
+            return
+        # A reservoir filled by the shrink also needs its Algorithm L state, or it would never replace an item
+        self.items = self.rng.sample(self.items, size)
+        # The largest of the `size` smallest random keys out of `seen` follows Beta(size, seen - size + 1)
+        self.weight = self.rng.betavariate(size, self.seen - size + 1)
+        self.next_index = self.seen - 1
+        self.next_index += int(math.log(self._uniform()) / math.log1p(-self.weight)) + 1
+
+
+class StratifiedSampler:
+    """Sample of `size` items split as evenly as possible between at most `max_strata` strata."""
+
+    def __init__(self, size, seed=0, max_strata=1000, headroom=2):
+        self.size = size
+        self.rng = random.Random(seed)
+        self.max_strata = max_strata
+        self.headroom = headroom
+        self.reservoirs = {}
+
+    def add(self, stratum, item):
+        reservoir = self.reservoirs.get(stratum)
+        if reservoir is None:
+            if len(self.reservoirs) >= self.max_strata:
+                raise ValueError(f"More than {self.max_strata} strata: stratify by a coarser key.")
+            capacity = max(1, self.headroom * self.size // (len(self.reservoirs) + 1))
+            for other in self.reservoirs.values():
+                other.shrink(capacity)
+            reservoir = self.reservoirs[stratum] = Reservoir(capacity, self.rng)
+        reservoir.add(item)
+
+    def sample(self):
+        """Return the sampled items, stratum by stratum from the smallest to the largest."""
+        reservoirs = sorted(self.reservoirs.values(), key=lambda reservoir: reservoir.seen)
+        remaining = self.size
+        sample = []
+        for i, reservoir in enumerate(reservoirs):
+            quota = min(len(reservoir.items), remaining // (len(reservoirs) - i))
+            sample.extend(self.rng.sample(reservoir.items, quota))
+            remaining -= quota
+        return sample
@@ -70,15 +70,18 @@ def main(args):
     data_dict = read_jsonl(args.dataset_path)
     # data_dict = data_dict[:1000]
     dataset = Dataset.from_list(data_dict)
+    # The target can be an integer score or an expected score (llama_infer.py --scoring logprobs), which is kept as a
+    # regression target; the split is stratified on the rounded score
     dataset = dataset.map(
-        lambda x: {args.target_column: np.clip(int(x[args.target_column]), 0, 5)}, num_proc=cpu_count()
+        lambda x: {args.target_column: float(np.clip(x[args.target_column], 0, 5)),
+                   "score_class": int(np.clip(round(x[args.target_column]), 0, 5))}, num_proc=cpu_count()
     )
 
     dataset = dataset.cast_column(
-        args.target_column, ClassLabel(names=[str(i) for i in range(6)])
+        "score_class", ClassLabel(names=[str(i) for i in range(6)])
     )
     dataset = dataset.train_test_split(
-        train_size=len(dataset)-10 if args.no_eval else 0.9, seed=42, stratify_by_column=args.target_column
+        train_size=len(dataset)-10 if args.no_eval else 0.9, seed=42, stratify_by_column="score_class"
     )
 
     tokenizer = AutoTokenizer.from_pretrained(args.base_model_name)
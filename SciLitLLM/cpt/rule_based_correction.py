@@ -0,0 +1,40 @@
+"""Rule-based repair of common PDF extraction artifacts, and a score of the artifacts left for the LLM."""
+import re
+
+LIGATURES = str.maketrans({'ﬀ': 'ff', 'ﬁ': 'fi', 'ﬂ': 'fl', 'ﬃ': 'ffi', 'ﬄ': 'ffl', 'ﬅ': 'st', 'ﬆ': 'st'})
+
+HYPHENATED_LINE_BREAK = re.compile(r'(?<=[a-z])-[ \t]*\n[ \t]*(?=[a-z])')
+SOFT_LINE_BREAK = re.compile(r'(?<=[^\s.!?:;])[ \t]*\n[ \t]*(?=[a-z(])|(?<=,)[ \t]*\n[ \t]*(?=\S)')
+HORIZONTAL_SPACES = re.compile(r'[ \t ]+')
+SPACE_BEFORE_PUNCTUATION = re.compile(r' +(?=[,.;:!?)\]])')
+SPACE_AFTER_BRACKET = re.compile(r'(?<=[(\[]) +')
+SPACE_AROUND_LINE_BREAK = re.compile(r' *\n *')
+EXTRA_BLANK_LINES = re.compile(r'\n{3,}')
+
+GLUED_WORDS = re.compile(r'\b[a-z]{2,}[A-Z][a-z]+')
+SPACED_LETTERS = re.compile(r'\b(?:[A-Za-z] ){3,}[A-Za-z]\b')
+SPLIT_HYPHENATION = re.compile(r'\b[a-z]+- [a-z]+\b')
+MID_SENTENCE_LINE_BREAK = re.compile(r'(?<=[^\s.!?:;])\n(?=[A-Za-z])')
+WORD = re.compile(r'\S+')
+
+
+def rule_based_fix(text):
+    """Return the text with hyphenation and soft line breaks removed, ligatures expanded and whitespace normalized."""
+    text = text.translate(LIGATURES)
+    text = HYPHENATED_LINE_BREAK.sub('', text)
+    text = SOFT_LINE_BREAK.sub(' ', text)
+    text = HORIZONTAL_SPACES.sub(' ', text)
+    text = SPACE_BEFORE_PUNCTUATION.sub('', text)
+    text = SPACE_AFTER_BRACKET.sub('', text)
+    text = SPACE_AROUND_LINE_BREAK.sub('\n', text)
+    text = EXTRA_BLANK_LINES.sub('\n\n', text)
+    return text.strip()
+
+
+def artifact_score(text):
+    """Return the number of artifacts left for a language model to repair, per 100 words."""
+    num_words = len(WORD.findall(text))
+    if num_words == 0:
+        return 0.0
+    artifacts = sum(len(pattern.findall(text)) for pattern in (GLUED_WORDS, SPACED_LETTERS, SPLIT_HYPHENATION, MID_SENTENCE_LINE_BREAK))
+    return 100 * artifacts / num_words
@@ -0,0 +1,130 @@
+"""Token-budgeted chunking of text into spans of the original string, ending on natural boundaries."""
+import re
+import zlib
+import itertools
+
+# Chunk boundaries, from most to least preferred
+BOUNDARIES = [re.compile(r'\n[ \t\r\f\v]*\n\s*'), re.compile(r'\n\s*'), re.compile(r'(?<=[.!?])\s+'), re.compile(r'\s+')]
+WHITESPACE = re.compile(r'\s*')
+APPROXIMATE_TOKEN = re.compile(r'\w+|[^\w\s]')
+
+
+def approximate_token_count(text):
+    """Estimate the number of tokens of a text without a tokenizer: 4 tokens for every 3 words or punctuation marks."""
+    return (len(APPROXIMATE_TOKEN.findall(text)) * 4 + 2) // 3
+
+
+def load_token_counter(tokenizer_name=None):
+    """Return a function counting the tokens of a text with a Hugging Face tokenizer, or the approximate count if no name is given."""
+    if not tokenizer_name:
+        return approximate_token_count
+    try:
+        from transformers import AutoTokenizer
+    except ImportError as e:
+        raise ImportError("Counting tokens with a tokenizer requires the 'transformers' package.") from e
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+    return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def load_token_truncator(tokenizer_name=None):
+    """Return a function `truncate(text, max_tokens)` keeping the longest prefix of a text that fits in `max_tokens`
+    tokens of a Hugging Face tokenizer, or of the approximate count if no name is given."""
+    if not tokenizer_name:
+        def truncate(text, max_tokens):
+            max_matches = max_tokens * 3 // 4
+            matches = list(itertools.islice(APPROXIMATE_TOKEN.finditer(text), max_matches + 1))
+            if len(matches) <= max_matches:
+                return text
+            return text[:matches[max_matches - 1].end()] if max_matches > 0 else ''
+        return truncate
+    try:
+        from transformers import AutoTokenizer
+    except ImportError as e:
+        raise ImportError("Truncating with a tokenizer requires the 'transformers' package.") from e
+    tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+
+    def truncate(text, max_tokens):
+        # Tokens are rarely longer than 16 characters, so only a prefix of a long text needs to be tokenized
+        prefix = text[:max_tokens * 16]
+        encoding = tokenizer(prefix, add_special_tokens=False, return_offsets_mapping=tokenizer.is_fast)
+        if len(encoding['input_ids']) <= max_tokens and len(prefix) < len(text):
+            encoding = tokenizer(text, add_special_tokens=False, return_offsets_mapping=tokenizer.is_fast)
+        if len(encoding['input_ids']) <= max_tokens:
+            return text
+        if tokenizer.is_fast:
+            return text[:encoding['offset_mapping'][max_tokens - 1][1]] if max_tokens > 0 else ''
+        return tokenizer.decode(encoding['input_ids'][:max_tokens])
+    return truncate
+
+
+def break_before(text, start, end):
+    """Return where to end a chunk starting at `start` so that it ends at or before `end`, on the best boundary in its second half."""
+    for boundary in BOUNDARIES:
+        last = None
+        for match in boundary.finditer(text, start + (end - start) // 2, end):
+            if match.start() > start:
+                last = match.start()
+        if last is not None:
+            while text[last - 1].isspace():
+                last -= 1
+            return last
+    return end
+
+
+def anchored_end(text, start, end, min_fill=0.75, anchor_rate=4):
+    """Return the first content-defined boundary in the last quarter of the span [start, end), or `end` if there is none.
+
+    A boundary is an anchor if the text following it hashes to 0 modulo `anchor_rate`, so spans cut at anchors fall back
+    onto the same ends after an edit earlier in the text.
+    """
+    lower = start + int((end - start) * min_fill)
+    for boundary in BOUNDARIES:
+        for match in boundary.finditer(text, lower, end):
+            if match.start() > start and zlib.crc32(text[match.end():match.end() + 16].encode('utf-8')) % anchor_rate == 0:
+                last = match.start()
+                while text[last - 1].isspace():
+                    last -= 1
+                return last
+    return end
+
+
+def chunk_spans(text, max_tokens, count_tokens=approximate_token_count, chars_per_token=4.0, max_tries=4, resync=False):
+    """Split a text into (start, end) spans of at most `max_tokens` tokens each, ending on natural boundaries. With
+    `resync`, spans end at content-defined anchors where possible, so the spans after a local edit stay the same."""
+    spans = []
+    start = WHITESPACE.match(text).end()
+    while start < len(text):
+        window = max(1, int(max_tokens * chars_per_token))
+        best_end = None
+        for _ in range(max_tries):
+            end = len(text) if start + window >= len(text) else break_before(text, start, start + window)
+            tokens = count_tokens(text[start:end])
+            if tokens <= max_tokens:
+                if best_end is None or end > best_end:
+                    best_end, best_tokens = end, tokens
+                if end == len(text) or tokens >= 0.9 * max_tokens:
+                    break
+            window = max(1, int((end - start) * 0.95 * max_tokens / max(tokens, 1)))
+        while best_end is None:
+            # Denser than any rescaled window: halve it without looking for a boundary
+            window = max(1, window // 2)
+            end = min(len(text), start + window)
+            tokens = count_tokens(text[start:end])
+            if window == 1 or tokens <= max_tokens:
+                best_end, best_tokens = end, tokens
+        chars_per_token = max((best_end - start) / max(best_tokens, 1), 1.0)
+        if resync and best_end < len(text):
+            best_end = anchored_end(text, start, best_end)
+        spans.append((start, best_end))
+        start = WHITESPACE.match(text, best_end).end()
+    return spans
+
+
+def separators(text, spans):
+    """Return the original text preceding each span: '' for the first one, then the whitespace between consecutive spans."""
+    return [''] + [text[previous_end:start] for (_, previous_end), (start, _) in zip(spans, spans[1:])]
+
+
+def join_chunks(chunks, chunk_separators):
+    """Join (corrected) chunks with the whitespace that separated them in the original text, as returned by `separators`."""
+    return "".join(separator + chunk for separator, chunk in zip([''] + list(chunk_separators[1:]), chunks))
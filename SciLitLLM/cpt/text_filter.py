@@ -0,0 +1,110 @@
+"""Cheap batched pre-filter flagging unusable extracted text (scans, numeric dumps, broken encodings)."""
+import re
+import numpy as np
+
+# Character classes
+ALPHA, DIGIT, SPACE, SYMBOL, NON_ASCII, BAD = range(6)
+NUM_CLASSES = 6
+
+ASCII_CLASSES = np.full(128, SYMBOL, dtype=np.int64)
+for code in range(128):
+    char = chr(code)
+    if char.isalpha():
+        ASCII_CLASSES[code] = ALPHA
+    elif char.isdigit():
+        ASCII_CLASSES[code] = DIGIT
+    elif char.isspace():
+        ASCII_CLASSES[code] = SPACE
+    elif code < 32 or code == 127:
+        ASCII_CLASSES[code] = BAD
+
+FEATURE_NAMES = [
+    'alpha_ratio', 'digit_ratio', 'whitespace_ratio', 'symbol_ratio', 'non_ascii_ratio', 'bad_char_ratio',
+    'mean_word_length', 'dictionary_word_ratio', 'symbol_word_ratio',
+]
+
+# (min, max) bounds of each feature; None means unbounded
+DEFAULT_THRESHOLDS = {
+    'alpha_ratio': (0.4, None),
+    'digit_ratio': (None, 0.3),
+    'non_ascii_ratio': (None, 0.3),
+    'bad_char_ratio': (None, 0.01),
+    'mean_word_length': (3.0, 12.0),
+    'dictionary_word_ratio': (0.1, None),
+    'symbol_word_ratio': (None, 0.3),
+}
+
+# Frequent English words, used as the dictionary when no word list is given
+COMMON_WORDS = set("""
+the of and to a in is that for it as was with be by on not he this are or his from at which but have an they you
+were her she there been one all we their has would when if so no will more can its also into other than some what
+only these may such them then two most any first over who out about our new used between each time both many well
+should very through how could where after those under same while being because however here must during without
+high different large small number several within based given value values result results method methods data
+model models study analysis using use show shown shows table figure effect effects system systems order case cases
+form found present due thus non total various further since although among higher lower obtained observed respectively
+increase increased decrease reduced significant significantly level levels rate process structure function general
+important similar specific following above below per low whereas rather often even less much like known
+""".split())
+
+LETTER_RUN = re.compile(r"[^\W\d_]+")
+SYMBOL_WORD = re.compile(r"(?<!\S)[^\w\s]+(?!\S)")
+
+
+def load_dictionary(dictionary_path=None):
+    """Return a set of lowercased words from a word-list file (one word per line), or the bundled common words."""
+    if dictionary_path is None:
+        return COMMON_WORDS
+    with open(dictionary_path, 'r', encoding='utf-8') as f:
+        return {line.strip().lower() for line in f if line.strip()}
+
+
+def char_class_ratios(texts):
+    """Return an (n, NUM_CLASSES) array with the share of each character class in each text."""
+    lengths = np.array([len(text) for text in texts], dtype=np.int64)
+    # Lone surrogates (e.g. from an escaped '\ud83d' in the JSON input) are kept as one code point each
+    codes = np.frombuffer("".join(texts).encode('utf-32-le', errors='surrogatepass'), dtype=np.uint32)
+    classes = np.where(codes < 128, ASCII_CLASSES[np.minimum(codes, 127)], NON_ASCII)
+    # Replacement characters, lone surrogates and private-use code points are typical of broken font encodings
+    classes[(codes == 0xFFFD) | ((codes >= 0xD800) & (codes <= 0xF8FF))] = BAD
+    doc_ids = np.repeat(np.arange(len(texts)), lengths)
+    counts = np.bincount(doc_ids * NUM_CLASSES + classes, minlength=len(texts) * NUM_CLASSES)
+    return counts.reshape(len(texts), NUM_CLASSES) / np.maximum(lengths, 1)[:, None]
+
+
+def word_features(text, dictionary):
+    """Return the word count, the share of dictionary words and the share of words made only of symbols."""
+    num_words = len(text.split())
+    if num_words == 0:
+        return 0, 0.0, 0.0
+    dictionary_words = sum(word in dictionary for word in LETTER_RUN.findall(text.lower()))
+    symbol_words = len(SYMBOL_WORD.findall(text))
+    return num_words, dictionary_words / num_words, symbol_words / num_words
+
+
+def compute_features(texts, dictionary=COMMON_WORDS, sample_chars=20000):
+    """Return an (n, len(FEATURE_NAMES)) feature array for a batch of texts, computed on their first `sample_chars` characters."""
+    samples = [text[:sample_chars] for text in texts]
+    features = np.zeros((len(samples), len(FEATURE_NAMES)))
+    if not samples:
+        return features
+    features[:, :NUM_CLASSES] = char_class_ratios(samples)
+    features[:, NUM_CLASSES:] = [word_features(sample, dictionary) for sample in samples]
+    # Mean word length: non-whitespace characters per word
+    lengths = np.array([len(sample) for sample in samples])
+    num_words = features[:, NUM_CLASSES]
+    features[:, NUM_CLASSES] = lengths * (1 - features[:, SPACE]) / np.maximum(num_words, 1)
+    return features
+
+
+def filter_texts(features, thresholds=DEFAULT_THRESHOLDS):
+    """Return a boolean keep mask and, for each text, the list of features outside their bounds."""
+    violations = np.zeros((len(features), len(FEATURE_NAMES)), dtype=bool)
+    for name, (low, high) in thresholds.items():
+        column = FEATURE_NAMES.index(name)
+        if low is not None:
+            violations[:, column] |= features[:, column] < low
+        if high is not None:
+            violations[:, column] |= features[:, column] > high
+    reasons = [[FEATURE_NAMES[column] for column in np.flatnonzero(row)] for row in violations]
+    return ~violations.any(axis=1), reasons
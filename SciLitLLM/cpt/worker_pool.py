@@ -0,0 +1,147 @@
+"""Process pool that kills and replaces a worker whose task is past its deadline, that died or that uses too much memory."""
+import os
+import time
+import resource
+import collections
+import multiprocessing
+import multiprocessing.connection
+
+
+def _resident_memory():
+    """Resident set size of this process in bytes (the peak one where /proc is not available)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _worker_loop(conn, initializer, initargs):
+    if initializer is not None:
+        initializer(*initargs)
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        func, args = task
+        try:
+            result, failure, out_of_memory = func(*args), None, False
+        except MemoryError:
+            result, failure, out_of_memory = None, "memory limit exceeded", True
+        except Exception as e:
+            result, failure, out_of_memory = None, f"{type(e).__name__}: {e}", False
+        conn.send((result, failure, out_of_memory, _resident_memory()))
+
+
+class _Worker:
+    def __init__(self, initializer, initargs):
+        self.conn, child_conn = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=_worker_loop, args=(child_conn, initializer, initargs), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.task = None
+        self.started = None
+        self.tasks_done = 0
+
+    def stop(self, kill=False):
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+        self.process.join(timeout=None if kill else 5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class DeadlinePool:
+    """Process pool that kills and replaces a worker whose task runs past `deadline` seconds or that died, and replaces
+    one that ran out of memory or is left above `max_rss_mb` of resident memory after its task."""
+
+    def __init__(self, processes, initializer=None, initargs=(), maxtasksperchild=None, deadline=0, max_rss_mb=0):
+        self.initializer = initializer
+        self.initargs = initargs
+        self.maxtasksperchild = maxtasksperchild
+        self.deadline = deadline
+        self.max_rss = max_rss_mb * 1024 * 1024
+        self.queue = collections.deque()
+        self.workers = [_Worker(initializer, initargs) for _ in range(processes)]
+
+    def submit(self, func, *args):
+        """Queue `func(*args)`; `func` must be picklable, i.e. defined at module level."""
+        self.queue.append((func, args, False))
+
+    def _replace(self, index, kill=False):
+        self.workers[index].stop(kill=kill)
+        self.workers[index] = _Worker(self.initializer, self.initargs)
+
+    def _dispatch(self):
+        for index, worker in enumerate(self.workers):
+            if not self.queue:
+                return
+            if worker.task is not None:
+                continue
+            task = self.queue.popleft()
+            try:
+                worker.conn.send(task[:2])
+            except (BrokenPipeError, OSError):
+                self.queue.appendleft(task)
+                self._replace(index, kill=True)
+                continue
+            worker.task, worker.started = task, time.monotonic()
+
+    def results(self):
+        """Yield (func, args, result, failure) for every task as it finishes; `failure` is None on success."""
+        while True:
+            self._dispatch()
+            busy = [(index, worker) for index, worker in enumerate(self.workers) if worker.task is not None]
+            if not busy:
+                return
+            timeout = None
+            if self.deadline > 0:
+                timeout = max(0.0, min(worker.started + self.deadline for _, worker in busy) - time.monotonic())
+            ready = multiprocessing.connection.wait([worker.conn for _, worker in busy] + [worker.process.sentinel for _, worker in busy], timeout)
+            now = time.monotonic()
+            for index, worker in busy:
+                (func, args, retried), result, failure, lost, out_of_memory, retire = worker.task, None, None, False, False, False
+                if worker.conn in ready or worker.conn.poll():
+                    try:
+                        result, failure, out_of_memory, rss = worker.conn.recv()
+                        retire = out_of_memory or (self.max_rss > 0 and rss > self.max_rss)
+                    except (EOFError, OSError):
+                        failure, lost = f"worker exited with code {worker.process.exitcode}", True
+                elif worker.process.sentinel in ready or not worker.process.is_alive():
+                    worker.process.join()
+                    failure, lost = f"worker exited with code {worker.process.exitcode}", True
+                elif self.deadline > 0 and now - worker.started >= self.deadline:
+                    failure, lost = f"killed after {self.deadline}s", True
+                else:
+                    continue
+                worker.task = None
+                worker.tasks_done += 1
+                if lost:
+                    self._replace(index, kill=True)
+                elif retire or (self.maxtasksperchild and worker.tasks_done >= self.maxtasksperchild):
+                    self._replace(index)
+                if out_of_memory and worker.tasks_done > 1 and not retried:
+                    # Earlier tasks may have leaked the memory, so give the task one more try on a fresh worker
+                    self.queue.appendleft((func, args, True))
+                    continue
+                yield func, args, result, failure
+
+    def close(self):
+        for worker in self.workers:
+            worker.stop(kill=worker.task is not None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,23 +1,45 @@
 import os
-import PyPDF2
+import sys
+import argparse
 from collections import Counter
+from multiprocessing import Pool
 import re
-import nltk
-from nltk.corpus import stopwords
 
-# Download stop words list
-nltk.download('stopwords')
-
-def extract_text_from_pdf(pdf_path):
+# The PDF extraction backends are shared with the CPT pipeline
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'cpt'))
+from pdf_extractors import EXTRACTORS, get_extractor
+from parse_cache import ParseCache, extract_pages_cached
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from utils.word_frequency_store import WordFrequencyStore
+
+# English stop words of the NLTK stopwords corpus, bundled so that no download is needed
+ENGLISH_STOP_WORDS = {
+    'i', 'me', 'my', 'myself', 'we', 'our', 'ours', 'ourselves', 'you', "you're", "you've", "you'll", "you'd",
+    'your', 'yours', 'yourself', 'yourselves', 'he', 'him', 'his', 'himself', 'she', "she's", 'her', 'hers',
+    'herself', 'it', "it's", 'its', 'itself', 'they', 'them', 'their', 'theirs', 'themselves', 'what', 'which',
+    'who', 'whom', 'this', 'that', "that'll", 'these', 'those', 'am', 'is', 'are', 'was', 'were', 'be', 'been',
+    'being', 'have', 'has', 'had', 'having', 'do', 'does', 'did', 'doing', 'a', 'an', 'the', 'and', 'but', 'if',
+    'or', 'because', 'as', 'until', 'while', 'of', 'at', 'by', 'for', 'with', 'about', 'against', 'between',
+    'into', 'through', 'during', 'before', 'after', 'above', 'below', 'to', 'from', 'up', 'down', 'in', 'out',
+    'on', 'off', 'over', 'under', 'again', 'further', 'then', 'once', 'here', 'there', 'when', 'where', 'why',
+    'how', 'all', 'any', 'both', 'each', 'few', 'more', 'most', 'other', 'some', 'such', 'no', 'nor', 'not',
+    'only', 'own', 'same', 'so', 'than', 'too', 'very', 's', 't', 'can', 'will', 'just', 'don', "don't",
+    'should', "should've", 'now', 'd', 'll', 'm', 'o', 're', 've', 'y', 'ain', 'aren', "aren't", 'couldn',
+    "couldn't", 'didn', "didn't", 'doesn', "doesn't", 'hadn', "hadn't", 'hasn', "hasn't", 'haven', "haven't",
+    'isn', "isn't", 'ma', 'mightn', "mightn't", 'mustn', "mustn't", 'needn', "needn't", 'shan', "shan't",
+    'shouldn', "shouldn't", 'wasn', "wasn't", 'weren', "weren't", 'won', "won't", 'wouldn', "wouldn't"
+}
+
+def extract_text_from_pdf(pdf_path, extractor="pypdf2", cache_dir=None):
     """
-    Extract text from a PDF file using PyPDF2.
+    Extract text from a PDF file using the given extraction backend (PyPDF2 by default).
+    With a `cache_dir`, the text is served from the parse cache shared with the CPT pipeline when possible.
     """
     text = ""
     try:
-        with open(pdf_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            for page in reader.pages:
-                text += page.extract_text() or ""
+        cache = ParseCache(cache_dir) if cache_dir else None
+        text = "".join(extract_pages_cached(get_extractor(extractor), pdf_path, cache))
     except Exception as e:
         print(f"Error extracting text from {pdf_path}: {e}")
     return text
@@ -39,10 +61,15 @@ def clean_text(text):
     text = text.lower()
     return text
 
-def load_stop_words():
+def load_stop_words(use_nltk=False):
     """
-    Load stop words from the NLTK library.
+    Load the bundled English stop words, or those of the NLTK library (downloading them if needed) with `use_nltk`.
     """
+    if not use_nltk:
+        return set(ENGLISH_STOP_WORDS)
+    import nltk
+    nltk.download('stopwords', quiet=True)
+    from nltk.corpus import stopwords
     return set(stopwords.words('english'))
 
 def get_chemical_elements():
@@ -59,51 +86,112 @@ def get_chemical_elements():
         'rf', 'db', 'sg', 'bh', 'hs', 'mt', 'ds', 'rg', 'cn', 'uut', 'fl', 'uup', 'lv', 'uus', 'uuo'
     }
 
-def construct_word_frequency_table(folder_path, parsed_folder_path):
+_stop_words = None
+_chemical_elements = None
+
+def init_worker(use_nltk_stopwords=False):
     """
-    Construct a word frequency table from all PDF files in a given folder, save parsed text, and filter out stop words and numbers.
+    Load the stop words and chemical elements once per pool worker.
     """
-    word_counter = Counter()
-    stop_words = load_stop_words()
-    chemical_elements = get_chemical_elements()
-
-    if not os.path.exists(parsed_folder_path):
-        os.makedirs(parsed_folder_path)
+    global _stop_words, _chemical_elements
+    _stop_words = load_stop_words(use_nltk_stopwords)
+    _chemical_elements = get_chemical_elements()
 
-    for filename in os.listdir(folder_path):
-        if filename.endswith('.pdf'):
-            pdf_path = os.path.join(folder_path, filename)
-            text = extract_text_from_pdf(pdf_path)
-            if text:
-                output_txt_path = os.path.join(parsed_folder_path, os.path.splitext(filename)[0] + '.txt')
-                save_text_to_file(text, output_txt_path)
+def count_words(text):
+    """
+    Count the keywords of a text, filtering out stop words, numbers and short words that are not chemical elements.
+    """
+    cleaned_text = clean_text(text)
+    return Counter(word for word in cleaned_text.split()
+                   if word not in _stop_words
+                   and (len(word) > 2 or word in _chemical_elements))
 
-                cleaned_text = clean_text(text)
-                words = [word for word in cleaned_text.split() 
-                         if word not in stop_words 
-                         and (len(word) > 2 or word in chemical_elements)]
-                word_counter.update(words)
+def process_pdf_batch(task):
+    """
+    Extract, save and count the words of a batch of PDFs of one domain. Returns the domain, the batch's word counts
+    and the names of the PDFs in the batch.
+    """
+    domain, pdf_paths, parsed_folder_path, extractor, cache_dir = task
+    word_counter = Counter()
+    for pdf_path in pdf_paths:
+        text = extract_text_from_pdf(pdf_path, extractor, cache_dir)
+        if text:
+            output_txt_path = os.path.join(parsed_folder_path, os.path.splitext(os.path.basename(pdf_path))[0] + '.txt')
+            save_text_to_file(text, output_txt_path)
+            word_counter.update(count_words(text))
+    return domain, word_counter, [os.path.basename(pdf_path) for pdf_path in pdf_paths]
+
+def construct_word_frequency_tables(domain_folders, extractor="pypdf2", num_workers=None, batch_size=4, use_nltk_stopwords=False, cache_dir=None,
+                                    counted_sources=None):
+    """
+    Construct the word frequency tables of several domains concurrently.
 
-    return word_counter
+    `domain_folders` maps each domain to its (folder_path, parsed_folder_path). PDFs of all domains are spread over
+    a process pool in batches of `batch_size`; each batch returns a partial Counter that is merged into its domain.
+    PDFs listed in `counted_sources[domain]` are skipped. Returns the Counter and the counted PDF names of each domain.
+    """
+    counted_sources = counted_sources or {}
+    tasks = []
+    for domain, (folder_path, parsed_folder_path) in domain_folders.items():
+        if not os.path.exists(parsed_folder_path):
+            os.makedirs(parsed_folder_path)
+        skip = set(counted_sources.get(domain, ()))
+        pdf_paths = [os.path.join(folder_path, filename) for filename in os.listdir(folder_path) if filename.endswith('.pdf') and filename not in skip]
+        for i in range(0, len(pdf_paths), batch_size):
+            tasks.append((domain, pdf_paths[i:i + batch_size], parsed_folder_path, extractor, cache_dir))
+
+    word_counters = {domain: Counter() for domain in domain_folders}
+    sources = {domain: [] for domain in domain_folders}
+    with Pool(processes=num_workers, initializer=init_worker, initargs=(use_nltk_stopwords,)) as pool:
+        for domain, partial_counter, batch_sources in pool.imap_unordered(process_pdf_batch, tasks):
+            word_counters[domain].update(partial_counter)
+            sources[domain].extend(batch_sources)
+    return word_counters, sources
+
+def construct_word_frequency_table(folder_path, parsed_folder_path, extractor="pypdf2", num_workers=None, batch_size=4, use_nltk_stopwords=False, cache_dir=None):
+    """
+    Construct a word frequency table from all PDF files in a given folder, save parsed text, and filter out stop words and numbers.
+    """
+    word_counters, _ = construct_word_frequency_tables({folder_path: (folder_path, parsed_folder_path)},
+                                                       extractor, num_workers, batch_size, use_nltk_stopwords, cache_dir)
+    return word_counters[folder_path]
 
 def save_word_frequency_table(word_counter, output_path):
     """
     Save the word frequency table to a file.
     """
-    with open(output_path, 'w', encoding='utf-8') as file:
-        file.write("Word Frequency Table:\n")
-        for word, count in word_counter.most_common():
-            file.write(f"{word}: {count}\n")
-
-# list all domain directories under the foler
-folder = "reference_papers"
-domains = [d for d in os.listdir(folder) if os.path.isdir(os.path.join(folder, d))]
-
-for domain in domains:
-    folder_path = f"./reference_papers/{domain}"
-    parsed_folder_path = f'./parsed_reference/{domain}'
-    output_word_table_path = f'./parsed_reference/{domain}/word_frequency_table.txt'
-
-    word_counter = construct_word_frequency_table(folder_path, parsed_folder_path)
-    save_word_frequency_table(word_counter, output_word_table_path)
+    WordFrequencyStore.from_counter(word_counter).export_text(output_path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the keyword frequency table of each domain from its reference papers.")
+    parser.add_argument('--extractor', type=str, default='pypdf2', choices=list(EXTRACTORS) + ['auto'], help="Text-extraction backend.")
+    parser.add_argument('--num_workers', type=int, default=None, help="Number of worker processes (default: number of CPUs).")
+    parser.add_argument('--batch_size', type=int, default=4, help="Number of PDFs counted by a worker per task.")
+    parser.add_argument('--nltk_stopwords', action='store_true', help="Use (and download if needed) the NLTK stop words instead of the bundled list.")
+    parser.add_argument('--cache_dir', type=str, default=None, help="Directory of the parse cache shared with the CPT pipeline; disabled by default.")
+    parser.add_argument('--incremental', action='store_true', help="Only count PDFs missing from the existing word frequency store and merge them into it.")
+    args = parser.parse_args()
+
+    # list all domain directories under the foler
+    folder = "reference_papers"
+    domains = [d for d in os.listdir(folder) if os.path.isdir(os.path.join(folder, d))]
+    domain_folders = {domain: (f"./reference_papers/{domain}", f'./parsed_reference/{domain}') for domain in domains}
+
+    stores = {}
+    if args.incremental:
+        for domain in domains:
+            store_path = f'./parsed_reference/{domain}/word_frequency_store'
+            if os.path.exists(store_path):
+                stores[domain] = WordFrequencyStore.load(store_path, mmap=False)
+    counted_sources = {domain: store.sources for domain, store in stores.items()}
+
+    word_counters, sources = construct_word_frequency_tables(domain_folders, args.extractor, args.num_workers, args.batch_size,
+                                                             args.nltk_stopwords, args.cache_dir, counted_sources)
+    for domain, word_counter in word_counters.items():
+        if domain in stores:
+            store = stores[domain].merge(word_counter, sources[domain])
+        else:
+            store = WordFrequencyStore.from_counter(word_counter, sources[domain])
+        store.save(f'./parsed_reference/{domain}/word_frequency_store')
+        store.export_text(f'./parsed_reference/{domain}/word_frequency_table.txt')
 
@@ -12,6 +12,7 @@ from prompts.table_extract_prompt import table_extract_example, table_extract_te
 from prompts.multiple_choice_prompt import multiple_choice_example, multiple_choice_template
 from prompts.TF_prompt import TF_example, TF_template
 from prompts.entity_extraction_prompt import entity_extraction_example, entity_extraction_template
+from utils.word_frequency_store import WordFrequencyStore
 
 # Function to load keywords and their frequencies from a word frequency table file
 def load_keywords(filepath):
@@ -19,12 +20,17 @@ def load_keywords(filepath):
     Load keywords and their frequencies from a file and normalize them to form probabilities.
     
     Parameters:
-    filepath (str): Path to the word frequency table file.
+    filepath (str): Path to the word frequency table file, or to a binary word frequency store directory,
+        which is memory-mapped instead of parsed.
 
     Returns:
     list: A list of keywords.
     list: A list of normalized probabilities corresponding to the keywords.
     """
+    if os.path.isdir(filepath):
+        store = WordFrequencyStore.load(filepath)
+        return store.words, store.probabilities()
+
     keywords = []
     probabilities = []
     with open(filepath, 'r') as file:
@@ -94,7 +100,11 @@ def generate_synthetic_data(num_samples=5, k=5, task_name="table_extraction", do
         raise ValueError("Unsupported task_name. Choose from 'table_extraction', 'multiple_choice', 'T_F', or 'entity_extraction'")
 
     # Load keywords and probabilities from the word frequency table for the specific domain
-    keywords, keyword_probabilities = load_keywords(f'./parsed_reference/{domain}/word_frequency_table.txt')
+    # Prefer the binary word frequency store over the text table when it exists
+    keywords_path = f'./parsed_reference/{domain}/word_frequency_store'
+    if not os.path.isdir(keywords_path):
+        keywords_path = f'./parsed_reference/{domain}/word_frequency_table.txt'
+    keywords, keyword_probabilities = load_keywords(keywords_path)
 
     synthetic_data = []
     # Generate the specified number of synthetic data samples
@@ -0,0 +1,128 @@
+import os
+import json
+import numpy as np
+from collections import Counter
+from collections.abc import Sequence
+
+# Files of a word frequency store directory
+VOCAB_FILE = "vocab.bin"
+OFFSETS_FILE = "offsets.npy"
+COUNTS_FILE = "counts.npy"
+SOURCES_FILE = "sources.json"
+
+
+class Vocabulary(Sequence):
+    """
+    Read-only sequence of words backed by a UTF-8 blob and an offsets array, decoding words only when accessed.
+    """
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        return bytes(self.blob[self.offsets[index]:self.offsets[index + 1]]).decode('utf-8')
+
+
+class WordFrequencyStore:
+    """
+    Binary word frequency table: a vocabulary and a count array sorted by decreasing count, plus the names of the
+    source documents already counted so that new documents can be merged in without rescanning the old ones.
+
+    The store is a directory holding `vocab.bin` (concatenated UTF-8 words), `offsets.npy` (word boundaries in
+    `vocab.bin`), `counts.npy` and `sources.json`; the arrays are memory-mapped on load.
+
+    Parameters:
+    words (Sequence): Words of the table.
+    counts (np.ndarray): Count of each word.
+    sources (list): Names of the documents counted in the table.
+    """
+    def __init__(self, words, counts, sources=()):
+        self.words = words
+        self.counts = counts
+        self.sources = list(sources)
+
+    def __len__(self):
+        return len(self.counts)
+
+    @classmethod
+    def from_counter(cls, word_counter, sources=()):
+        """
+        Build a store from a Counter of words.
+        """
+        items = word_counter.most_common()
+        words = [word for word, _ in items]
+        counts = np.array([count for _, count in items], dtype=np.int64)
+        return cls(words, counts, sources)
+
+    @classmethod
+    def load(cls, store_dir, mmap=True):
+        """
+        Load a store from a directory, memory-mapping its arrays unless `mmap` is False.
+        """
+        mmap_mode = 'r' if mmap else None
+        vocab_path = os.path.join(store_dir, VOCAB_FILE)
+        if mmap and os.path.getsize(vocab_path) > 0:
+            blob = np.memmap(vocab_path, dtype=np.uint8, mode='r')
+        else:
+            blob = np.fromfile(vocab_path, dtype=np.uint8)
+        offsets = np.load(os.path.join(store_dir, OFFSETS_FILE), mmap_mode=mmap_mode)
+        counts = np.load(os.path.join(store_dir, COUNTS_FILE), mmap_mode=mmap_mode)
+        with open(os.path.join(store_dir, SOURCES_FILE), 'r', encoding='utf-8') as f:
+            sources = json.load(f)
+        return cls(Vocabulary(blob, offsets), counts, sources)
+
+    def save(self, store_dir):
+        """
+        Write the store to a directory. Each file is written under a temporary name and renamed into place.
+        """
+        os.makedirs(store_dir, exist_ok=True)
+        encoded = [word.encode('utf-8') for word in self.words]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(word) for word in encoded], out=offsets[1:])
+
+        def write(file_name, write_fn):
+            tmp_path = os.path.join(store_dir, file_name + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                write_fn(f)
+            os.replace(tmp_path, os.path.join(store_dir, file_name))
+
+        write(VOCAB_FILE, lambda f: f.write(b"".join(encoded)))
+        write(OFFSETS_FILE, lambda f: np.save(f, offsets))
+        write(COUNTS_FILE, lambda f: np.save(f, np.asarray(self.counts, dtype=np.int64)))
+        write(SOURCES_FILE, lambda f: f.write(json.dumps(self.sources).encode('utf-8')))
+
+    def to_counter(self):
+        """
+        Return the table as a Counter of words.
+        """
+        return Counter(dict(zip(self.words, self.counts.tolist())))
+
+    def merge(self, word_counter, sources=()):
+        """
+        Return a new store with the counts of `word_counter` (counted from `sources`) added to this one.
+        """
+        merged = self.to_counter()
+        merged.update(word_counter)
+        return WordFrequencyStore.from_counter(merged, self.sources + list(sources))
+
+    def probabilities(self):
+        """
+        Return the counts normalized to probabilities.
+        """
+        return self.counts / self.counts.sum()
+
+    def export_text(self, output_path):
+        """
+        Write the table in the `word: count` text format of `word_frequency_table.txt`.
+        """
+        with open(output_path, 'w', encoding='utf-8') as file:
+            file.write("Word Frequency Table:\n")
+            for word, count in zip(self.words, self.counts.tolist()):
+                file.write(f"{word}: {count}\n")